@@ -0,0 +1,27 @@
+import time
+import gc
+
+class BootProfiler:
+    """
+    Records the time and free memory after every boot phase.
+    Create it as early as possible, the time is measured from there.
+    """
+    def __init__(self):
+        self.start = time.ticks_ms()
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.ticks_ms()
+        self.phases.append((phase, time.ticks_diff(now, self.start), time.ticks_diff(now, self.last), gc.mem_free()))
+        self.last = now
+
+    def report(self):
+        """
+        Returns the profile as a dictionary, ready for json.dumps()
+        """
+        return {
+            'total_ms': time.ticks_diff(self.last, self.start),
+            'phases': [{'phase': phase, 'ms': ms, 'dt_ms': dt_ms, 'mem_free': mem_free}
+                       for phase, ms, dt_ms, mem_free in self.phases],
+        }
@@ -0,0 +1,131 @@
+import array
+import json
+import time
+
+adcMax = 2**16 # 16 Bit
+adcVDD = 3.3   # Volt
+multi_Ib = 9800/4600
+U_1 = 4095/adcVDD # reference-value for dac's
+
+class Calibration:
+    """
+    ### Per-board calibration
+
+    Holds the correction table of one board and the tables derived from it:
+    * DAC: measured output voltage for a few DAC codes per channel. dac_code() inverts
+      this transfer by linear interpolation; without a table the nominal `U_1` is used.
+    * ADC: gain and offset per channel. They are folded into one scale and offset per
+      channel which map the raw read_u16() value to volts (ds, gs) or ampere (ib). The raw
+      readings of a point are summed as integers and converted once with convert(), so
+      the full ADC resolution is kept and no float math is needed per sample.
+    """
+    def __init__(self, table=None):
+        self.table = table or {}
+        self.table.setdefault('adc', {})
+        for channel in ('ds', 'gs', 'ib'):
+            self.table['adc'].setdefault(channel, [1.0, 0.0]) # gain, offset
+        self.scale = {}
+        for channel, (gain, offset) in self.table['adc'].items():
+            scale = gain * adcVDD / adcMax
+            if channel == 'ib':
+                scale = scale / multi_Ib / 7.8
+            self.scale[channel] = (scale, offset)
+
+    def convert(self, channel, raw):
+        """
+        Converts a raw read_u16() value (or the average of several) of channel 'ds', 'gs' or 'ib'.
+        """
+        scale, offset = self.scale[channel]
+        return raw * scale + offset
+
+    def raw_limit(self, channel, value):
+        """
+        Raw read_u16() value corresponding to `value`, e.g. the over-current threshold,
+        so single samples can be compared without converting them.
+        """
+        scale, offset = self.scale[channel]
+        return int((value - offset) / scale)
+
+    def dac_code(self, channel, value):
+        """
+        DAC code for the desired voltage `value` on channel 'ds' or 'gs'.
+        """
+        codes = self.table.get('codes')
+        volts = self.table.get(channel)
+        if not codes or not volts:
+            return int(value * U_1)
+        if value <= volts[0]:
+            return codes[0]
+        for idx in range(1, len(codes)):
+            if value <= volts[idx]:
+                span = volts[idx] - volts[idx - 1]
+                if span <= 0:
+                    return codes[idx]
+                code = codes[idx - 1] + (value - volts[idx - 1]) * (codes[idx] - codes[idx - 1]) / span
+                return int(code + 0.5)
+        return codes[-1]
+
+    def dac_codes(self, channel, values):
+        """
+        Precomputes the DAC codes for a list of voltages, e.g. before a sweep.
+        """
+        return array.array('H', [self.dac_code(channel, value) for value in values])
+
+    def save(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.table, file)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads the table from flash. Returns the nominal calibration if there is none.
+        """
+        try:
+            with open(filename) as file:
+                return cls(json.load(file))
+        except (OSError, ValueError):
+            return cls()
+
+def _read_avg(adc, multi):
+    total = 0
+    for _ in range(multi):
+        total += adc.read_u16()
+    return total / multi * adcVDD / adcMax
+
+def calibrate(dac_ds, dac_gs, adc_ds, adc_gs, adc_Ib, steps=16, multi=32, settle=0.1, old=None):
+    """
+    ### Calibration sweep
+
+    Measures the ADC offsets with both DACs at 0 V and then sweeps one DAC at a time
+    over `steps` codes while the other one stays at 0 V (no drain current flows).
+    The ADC gains of the old calibration are kept, they need an external reference.
+        Returns:
+            Calibration
+    """
+    adc_gain = {'ds': 1.0, 'gs': 1.0, 'ib': 1.0}
+    if old is not None:
+        for channel in adc_gain:
+            adc_gain[channel] = old.table['adc'][channel][0]
+    dac_ds.write(0)
+    dac_gs.write(0)
+    time.sleep(settle)
+    adc = {
+        'ds': [adc_gain['ds'], -adc_gain['ds'] * _read_avg(adc_ds, multi)],
+        'gs': [adc_gain['gs'], -adc_gain['gs'] * _read_avg(adc_gs, multi)],
+        'ib': [adc_gain['ib'], -adc_gain['ib'] * (_read_avg(adc_Ib, multi) / multi_Ib) / 7.8],
+    }
+    codes = [round(4095 * idx / (steps - 1)) for idx in range(steps)]
+    table = {'codes': codes, 'adc': adc}
+    for channel, dac, other, adc_ch in (('ds', dac_ds, dac_gs, adc_ds), ('gs', dac_gs, dac_ds, adc_gs)):
+        gain, offset = adc[channel]
+        other.write(0)
+        volts = []
+        for code in codes:
+            dac.write(code)
+            time.sleep(settle)
+            value = gain * _read_avg(adc_ch, multi) + offset
+            # the transfer must be monotonic to be inverted
+            volts.append(max(value, volts[-1]) if volts else value)
+        dac.write(0)
+        table[channel] = volts
+    return Calibration(table)
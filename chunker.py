@@ -0,0 +1,200 @@
+import struct
+import binascii
+import json
+import io
+
+# optional compression: micropython >= 1.21 ships `deflate`, cpython has `zlib`
+try:
+    import deflate
+except ImportError:
+    deflate = None
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+# header of every chunk: transfer id, chunk index, crc32 of the chunk data.
+# The number of chunks is only known at the end, it is sent in the manifest. With the
+# transfer id a receiver can ask for a lost manifest, see main.publish_result().
+HEADER = '<HHI'
+HEADER_SIZE = struct.calcsize(HEADER)
+
+def crc32(data, crc=0):
+    return binascii.crc32(data, crc) & 0xffffffff
+
+def iter_json(obj):
+    """
+    Encodes `obj` like json.dumps(), but piece by piece: lists of rows (lists or dicts)
+    are encoded one row at a time, so the complete string never exists in memory.
+    """
+    if type(obj) == dict:
+        yield '{'
+        sep = ''
+        for key, value in obj.items():
+            yield sep + json.dumps(key) + ': '
+            yield from iter_json(value)
+            sep = ', '
+        yield '}'
+    elif type(obj) in (list, tuple) and obj and type(obj[0]) in (list, tuple, dict):
+        yield '['
+        sep = ''
+        for value in obj:
+            yield sep
+            yield from iter_json(value)
+            sep = ', '
+        yield ']'
+    else:
+        yield json.dumps(obj)
+
+class ChunkStream:
+    """
+    Cuts a stream of bytes into numbered chunks of `chunk_size` bytes in one reused buffer.
+    feed() and finish() yield (idx, packed chunk); the crc of the whole transfer is
+    computed on the way. `size`, `count` and `crc` are final after finish().
+    `transfer_id` (0..65535) is written into every chunk header.
+    """
+    def __init__(self, chunk_size, transfer_id=0):
+        self.transfer_id = transfer_id
+        self.buf = bytearray(chunk_size)
+        self.view = memoryview(self.buf)
+        self.fill = 0
+        self.count = 0
+        self.size = 0
+        self.crc = 0
+
+    def _emit(self):
+        chunk = self.view[:self.fill]
+        self.crc = crc32(chunk, self.crc)
+        self.size += self.fill
+        idx = self.count
+        packed = struct.pack(HEADER, self.transfer_id, idx, crc32(chunk)) + chunk
+        self.count += 1
+        self.fill = 0
+        return idx, packed
+
+    def feed(self, data):
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data):
+            n = min(len(self.buf) - self.fill, len(data) - pos)
+            self.buf[self.fill:self.fill + n] = data[pos:pos + n]
+            self.fill += n
+            pos += n
+            if self.fill == len(self.buf):
+                yield self._emit()
+
+    def finish(self):
+        if self.fill:
+            yield self._emit()
+
+def compress_data(data):
+    """
+    zlib compatible compression of `data`. Returns None if no compression is available.
+    """
+    if deflate is not None and hasattr(deflate, 'DeflateIO'):
+        buf = io.BytesIO()
+        try:
+            with deflate.DeflateIO(buf, deflate.ZLIB) as d:
+                d.write(data)
+        except OSError:
+            # firmware built without compression support
+            return None
+        return buf.getvalue()
+    if zlib is not None:
+        return zlib.compress(data)
+    return None
+
+def _counted(pieces, stats):
+    for piece in pieces:
+        stats['length'] += len(piece)
+        yield piece
+
+def encode(result, compress=False, stats=None):
+    """
+    Generator of the encoded pieces (bytes) of a result: dicts are encoded with
+    iter_json(), str and bytes are sent as they are. With `compress` the pieces are
+    deflated, as a stream on cpython (zlib) and as a whole on micropython (deflate).
+    If a dict `stats` is given, stats['length'] is the uncompressed size at the end.
+    """
+    if type(result) == bytes:
+        pieces = (result,)
+    elif type(result) == str:
+        pieces = (result.encode('utf-8'),)
+    else:
+        pieces = (piece.encode('utf-8') for piece in iter_json(result))
+    if stats is not None:
+        stats['length'] = 0
+        pieces = _counted(pieces, stats)
+    if not compress:
+        yield from pieces
+    elif zlib is not None and hasattr(zlib, 'compressobj'):
+        compressor = zlib.compressobj()
+        for piece in pieces:
+            yield compressor.compress(piece)
+        yield compressor.flush()
+    else:
+        yield compress_data(b''.join(pieces))
+
+def can_compress():
+    return (zlib is not None and hasattr(zlib, 'compressobj')) or compress_data(b'') is not None
+
+def decompress(data):
+    if zlib is not None:
+        return zlib.decompress(data)
+    with deflate.DeflateIO(io.BytesIO(data), deflate.ZLIB) as d:
+        return d.read()
+
+def manifest(transfer_id, stream, chunk_size, length=None, compression=None):
+    """
+    Describes a chunked transfer. Is sent after the last chunk.
+        Args:
+            * transfer_id (int)
+            * stream (ChunkStream): after finish()
+            * chunk_size (int)
+            * length (int): size of the uncompressed payload, defaults to the transferred size
+            * compression (str or None): 'zlib' if the data is compressed
+        Returns:
+            dict
+    """
+    return {
+        'id': transfer_id,
+        'size': stream.size,
+        'length': stream.size if length is None else length,
+        'chunk_size': chunk_size,
+        'chunks': stream.count,
+        'crc': stream.crc,
+        'compression': compression,
+    }
+
+def unpack_chunk(payload):
+    """
+    Splits a received chunk into (transfer_id, idx, data).
+    Raises a ValueError if the crc does not match.
+    """
+    transfer_id, idx, crc = struct.unpack(HEADER, payload[:HEADER_SIZE])
+    data = bytes(payload[HEADER_SIZE:])
+    if crc32(data) != crc:
+        raise ValueError('crc mismatch in chunk %d of transfer %d' % (idx, transfer_id))
+    return transfer_id, idx, data
+
+def missing_chunks(manifest_dict, chunks):
+    """
+    Returns the indices of all chunks that have not been received yet.
+    `chunks` is a dictionary {idx: data}.
+    """
+    return [idx for idx in range(manifest_dict['chunks']) if idx not in chunks]
+
+def join_chunks(manifest_dict, chunks):
+    """
+    Reassembles the payload from a manifest and a dictionary {idx: data} of received chunks.
+    Raises a ValueError if chunks are missing or the crc of the whole transfer does not match.
+    """
+    missing = missing_chunks(manifest_dict, chunks)
+    if missing:
+        raise ValueError('missing chunks: %s' % missing)
+    data = b''.join(chunks[idx] for idx in range(manifest_dict['chunks']))
+    if crc32(data) != manifest_dict['crc']:
+        raise ValueError('crc mismatch in transfer %s' % manifest_dict['id'])
+    if manifest_dict.get('compression'):
+        data = decompress(data)
+    return data
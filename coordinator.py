@@ -0,0 +1,171 @@
+"""
+Shards a Combined-Sweep across all ready measuring stations and merges the results.
+
+Runs on a PC (cpython) and needs paho-mqtt. Works with real and emulated boards:
+
+    python coordinator.py --broker localhost --user felix \
+        --values '{"U_GS": [1.0, 1.5, 2.0, 2.5, 3.0], "U_DS": [0.0, 1.0, 2.0, 3.0]}'
+
+Emulated boards take [start, stop, step] for both axes, pass --emulated then.
+"""
+import argparse
+import json
+import time
+
+import chunker
+import shard
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+TOPIC_PREFIX = 'tobi_felix_hm_fk06'
+
+class Coordinator:
+    def __init__(self, broker, port=1883, prefix=TOPIC_PREFIX):
+        if mqtt is None:
+            raise ImportError('the coordinator needs paho-mqtt: pip install paho-mqtt')
+        self.prefix = prefix
+        self.states = {}    # board_id -> last state ('ready', 'busy', ...)
+        self.results = {}   # board_id -> result
+        self.manifests = {} # board_id -> manifest of a chunked result
+        self.chunks = {}    # board_id -> {idx: data}
+        self.transfers = {} # board_id -> transfer id of the received chunks
+        try:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError: # paho-mqtt < 2.0
+            self.client = mqtt.Client()
+        self.client.on_message = self._on_message
+        self.client.connect(broker, port)
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, message):
+        levels = message.topic.split('/')
+        kind = levels[1]
+        if kind == 'Zustand_Messplatz' and len(levels) == 3:
+            self.states[levels[2]] = message.payload.decode('utf-8')
+        elif kind == 'Paket':
+            try:
+                self.results[levels[4]] = json.loads(message.payload)
+            except ValueError: # e.g. 'unknown measurement type'
+                self.results[levels[4]] = message.payload.decode('utf-8')
+        elif kind == 'Paket_Manifest':
+            # the manifest is sent after the chunks
+            self.manifests[levels[4]] = json.loads(message.payload)
+            self._try_join(levels[4])
+        elif kind == 'Paket_Chunk':
+            try:
+                transfer_id, idx, data = chunker.unpack_chunk(message.payload)
+            except ValueError: # corrupted chunk, will be requested again
+                return
+            self.transfers[levels[4]] = transfer_id
+            self.chunks.setdefault(levels[4], {})[idx] = data
+            self._try_join(levels[4])
+
+    def _try_join(self, board):
+        manifest = self.manifests.get(board)
+        chunks = self.chunks.get(board, {})
+        if manifest is not None and not chunker.missing_chunks(manifest, chunks):
+            self.results[board] = json.loads(chunker.join_chunks(manifest, chunks))
+
+    def ready_boards(self, wait=3):
+        """
+        Asks all boards for their state and returns the ids of the ready ones.
+        """
+        self.client.subscribe(f'{self.prefix}/Zustand_Messplatz/+', 1)
+        self.client.publish(f'{self.prefix}/Zustand_Messplatz', '')
+        time.sleep(wait)
+        return sorted(board for board, state in self.states.items() if state == 'ready')
+
+    def request_missing(self, board):
+        """
+        Asks the board for its lost chunks, or for the manifest if that got lost.
+        """
+        manifest = self.manifests.get(board)
+        if manifest is None:
+            payload = json.dumps({'id': self.transfers[board]})
+        else:
+            missing = chunker.missing_chunks(manifest, self.chunks.get(board, {}))
+            payload = json.dumps({'id': manifest['id'], 'chunks': missing})
+        self.client.publish(f'{self.prefix}/Paket_Resend/{board}', payload)
+
+    def run(self, username, meas_type, value_dict, boards, n_rows=None, timeout=600):
+        """
+        Sends one shard of the sweep to every board and merges the results.
+        `n_rows` splits into contiguous row ranges, otherwise rows are split by stride.
+        Boards without rows (more boards than rows) get no job.
+        """
+        time_stamp = str(int(time.time()))
+        specs = shard.split(len(boards), n_rows)
+        boards = boards[:len(specs)]
+        for kind in ('Paket', 'Paket_Manifest', 'Paket_Chunk'):
+            self.client.subscribe(f'{self.prefix}/{kind}/{username}/{time_stamp}/+/{meas_type}', 1)
+        for board, spec in zip(boards, specs):
+            job = dict(value_dict)
+            job['shard'] = spec
+            self.client.publish(f'{self.prefix}/{board}/{username}/{time_stamp}/{meas_type}', json.dumps(job), 1)
+        start = time.time()
+        last_resend = start
+        while len(self.results) < len(boards):
+            if time.time() - start > timeout:
+                missing = [board for board in boards if board not in self.results]
+                raise TimeoutError(f'no result from boards {missing}')
+            time.sleep(0.5)
+            # every 10 s: ask again for lost chunks of unfinished transfers
+            if time.time() - last_resend > 10:
+                last_resend = time.time()
+                for board in set(self.manifests) | set(self.transfers):
+                    if board not in self.results:
+                        self.request_missing(board)
+        for board in boards:
+            if type(self.results[board]) != dict:
+                raise RuntimeError(f'board {board}: {self.results[board]}')
+        return shard.merge([self.results[board] for board in boards])
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+def main():
+    parser = argparse.ArgumentParser(description='Shards a Combined-Sweep across all ready boards.')
+    parser.add_argument('--broker', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--prefix', default=TOPIC_PREFIX)
+    parser.add_argument('--user', default='coordinator')
+    parser.add_argument('--type', default='Combined-Sweep')
+    parser.add_argument('--emulated', action='store_true', help='the values are [start, stop, step] ranges of emulated boards')
+    parser.add_argument('--values', required=True, help='value_dict of the sweep as json')
+    parser.add_argument('--ranges', action='store_true', help='split into contiguous row ranges instead of by stride')
+    parser.add_argument('--out', default=None, help='file for the merged result')
+    args = parser.parse_args()
+
+    value_dict = json.loads(args.values)
+    n_rows = None
+    if args.ranges:
+        u_gs = value_dict['U_GS']
+        if args.emulated:
+            from hw_emu import axis_len
+            n_rows = axis_len(u_gs)
+        else:
+            n_rows = len(u_gs)
+
+    coordinator = Coordinator(args.broker, args.port, args.prefix)
+    try:
+        boards = coordinator.ready_boards()
+        if not boards:
+            raise SystemExit('no ready boards found')
+        print(f'sharding across boards {boards}')
+        start = time.time()
+        result = coordinator.run(args.user, args.type, value_dict, boards, n_rows)
+        print(f"{len(result['row_index'])} rows in {time.time() - start:.1f} s")
+    finally:
+        coordinator.close()
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(result, file)
+    else:
+        print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
@@ -17,10 +17,10 @@ def dac(topic_dict, value_dict):
     emulation of MOSFET transistors
     """
     username = topic_dict['username']
-    meas_type = topic_dict['meas_type']
+    meas_type = meas_type_name(topic_dict['meas_type'])
     break_bool = False
 
-    if meas_type == 'SingleMeasurement':
+    if meas_type == 'Single-Measurement':
         U_DS = value_dict['U_DS']
         U_GS = value_dict['U_GS']
         I_D = calc_current(U_GS, U_DS)
@@ -50,7 +50,7 @@ def dac(topic_dict, value_dict):
         U_DS_list = [U_DS] * len(U_GS_list)
         return {'U_DS': U_DS_list, 'U_GS': U_GS_list, 'I_D': I_D_list, 'break_bool': break_bool}
 
-    elif meas_type == 'CombinedSweep':
+    elif meas_type == 'Combined-Sweep':
         start_gs, stop_gs, step_gs = value_dict['U_GS']
         stop_gs += step_gs
         start_ds, stop_ds, step_ds = value_dict['U_DS']
@@ -73,3 +73,70 @@ def dac(topic_dict, value_dict):
 
     else:
         return 'unknown measurement type'
+
+# old names of the emulation, accepted as aliases of the hardware names
+MEAS_TYPE_ALIASES = {'SingleMeasurement': 'Single-Measurement', 'CombinedSweep': 'Combined-Sweep'}
+
+# measurement types known by dac_stream(), same names as on real hardware
+MEAS_TYPES = ('Single-Measurement', 'Drain-Source-Sweep', 'Gate-Source-Sweep', 'Combined-Sweep') + tuple(MEAS_TYPE_ALIASES)
+
+def meas_type_name(meas_type):
+    """
+    hardware name of a measurement type, e.g. 'Combined-Sweep' for 'CombinedSweep'
+    """
+    return MEAS_TYPE_ALIASES.get(meas_type, meas_type)
+
+# time to wait between two emulated points, same as the settle time used by meas() on real hardware
+SETTLE_TIME = 0.1
+
+def axis_len(spec):
+    """
+    number of values of a [start, stop, step] axis
+    """
+    start, stop, step = spec
+    return int((stop + step - start) / step)
+
+def _axis(spec):
+    """
+    lazy version of the [start, stop, step] expansion used by dac()
+    """
+    start, stop, step = spec
+    for i in range(axis_len(spec)):
+        yield start + i * step
+
+def dac_stream(topic_dict, value_dict, rows=None):
+    """
+    streaming emulation of MOSFET transistors
+
+    Takes the same arguments as dac(), but yields one point at a time as a tuple
+    (row, U_DS, U_GS, I_D) instead of returning the complete result. `row` is the
+    index of the U_GS value for the Combined-Sweep and 0 for all other types.
+    No intermediate lists are created, so memory stays flat for large grids.
+    If `rows` is given, only those rows of a Combined-Sweep are emulated (sharding).
+    """
+    meas_type = meas_type_name(topic_dict['meas_type'])
+
+    if meas_type == 'Single-Measurement':
+        U_DS = value_dict['U_DS']
+        U_GS = value_dict['U_GS']
+        yield 0, U_DS, U_GS, calc_current(U_GS, U_DS)
+
+    elif meas_type == 'Drain-Source-Sweep':
+        U_GS = value_dict['U_GS']
+        for U_DS in _axis(value_dict['U_DS']):
+            yield 0, U_DS, U_GS, calc_current(U_GS, U_DS)
+
+    elif meas_type == 'Gate-Source-Sweep':
+        U_DS = value_dict['U_DS']
+        for U_GS in _axis(value_dict['U_GS']):
+            yield 0, U_DS, U_GS, calc_current(U_GS, U_DS)
+
+    elif meas_type == 'Combined-Sweep':
+        for row, U_GS in enumerate(_axis(value_dict['U_GS'])):
+            if rows is not None and row not in rows:
+                continue
+            for U_DS in _axis(value_dict['U_DS']):
+                yield row, U_DS, U_GS, calc_current(U_GS, U_DS)
+
+    else:
+        raise ValueError('unknown measurement type')
@@ -1,19 +1,22 @@
+# the boot profiler starts first, so the imports are measured as well
+from bootprof import BootProfiler
+boot = BootProfiler()
+
 from machine import Pin, I2C, ADC
-from mcp4725 import MCP4725
-from hw_emu import dac as emu
-from sync_time import ntp_sync
-import _thread
+import sync_time
 import mqtt_async
 import asyncio
 import network
-import urequests
 import array
-import random
 import mywlan
+import spool
+import calib
 import json
 import time
 import gc
 import os
+# rarely used modules (urequests, mcp4725, hw_emu, chunker, sampler, shard, machine)
+# are imported where they are needed to keep the boot short
 
 from ulogging import RotatingLogger
 logger = RotatingLogger(
@@ -21,12 +24,40 @@ logger = RotatingLogger(
     console_level=RotatingLogger.DEBUG,
     file_level=RotatingLogger.WARNING,
     filename="logging.txt",
-    max_size=50*1024
+    max_size=50*1024,
+    ring_size=256 # recent records of all levels in RAM, dumped via MQTT (see dump_log())
 )
+boot.mark('imports')
 # init a config to be edited by users
 config = {
     'mqtt_server': 'broker.hivemq.com',
     'mqtt_port': 1883,
+    # seconds between two ntp syncs and timeout of one ntp request
+    'ntp_interval': 3600,
+    'ntp_timeout': 2,
+    # fast wifi reconnect: cached network, seconds to wait for a direct join, reuse the cached ip config
+    'wifi_cache': 'wifi_cache.json',
+    'wifi_fast_timeout': 5,
+    'wifi_static_ip': False,
+    # results that could not be published are spooled to flash and replayed after a reconnect
+    'spool_file': 'spool.bin',
+    'spool_max_size': 64*1024,
+    'spool_batch': 5,       # results per batch
+    'spool_interval': 0.5,  # seconds between two replayed results
+    # per-board calibration table, written by a calibration sweep
+    'cal_file': 'calibration.json',
+    # seconds to wait after the registration, to make sure the register client is disconnected
+    'boot_settle': 5,
+    # results bigger than chunk_threshold bytes are sent in numbered chunks of chunk_size bytes
+    'chunk_size': 1024,
+    'chunk_threshold': 4096,
+    # deflate chunked results before sending (only if the firmware supports it)
+    'compress': False,
+    # seconds a chunked result is kept for resend requests
+    'resend_timeout': 60,
+    # run DAC/ADC sampling on the second core while the event loop publishes (sweeps only)
+    'dual_core': False,
+    'ring_size': 256,
 }
 # init a global dictionary for useage in multiple functions
 glob = {
@@ -51,15 +82,146 @@ glob = {
     'board_id': False,
     'mac_addr': None, 
     'wlan': None,
+    'wifi_cache': None,
+    'wifi_stats': {'fast': 0, 'scan': 0, 'failed_fast': 0, 'failed': 0, 'last_ms': None, 'last_path': None},
     # for measurement: arrays
     'gs_array': array.array('f', [0.0] * 5000),
     'ds_array': array.array('f', [0.0] * 5000),
     'ib_array': array.array('f', [0.0] * 5000),
+    # last chunked result, kept for resend requests
+    'transfer_id': 0,
+    'last_transfer': None,
+    # ring buffer between the sampling worker and the event loop (dual-core mode)
+    'ring': None,
+    # continuous acquisition (meas_type Time-Series)
+    'stream_task': None,
+    'stream_stop': False,
+    # offline result spool
+    'spool': None,
+    'spool_replay': False,
+    # calibration of DACs and ADCs (calib.Calibration)
+    'cal': None,
     }
 # ------------------------------------
 #  MQTT: Start of registration process
 # ------------------------------------
 
+def wifi_password(ssid):
+    """
+    Looks up the password of `ssid` in `mywlan_ssids.json`.
+    Supports {ssid: password} and [[ssid, password], ...]. Returns None if not found.
+    """
+    try:
+        with open('mywlan_ssids.json') as file:
+            ssids = json.load(file)
+        if type(ssids) == dict:
+            return ssids.get(ssid)
+        for entry in ssids:
+            if entry[0] == ssid:
+                return entry[1]
+    except Exception as e:
+        logger.debug('no password for %s: %s', ssid, e)
+    return None
+
+def wifi_cache_save(wlan):
+    """
+    Stores the network of the current connection for wifi_fast_join().
+    Flash is only written if something changed.
+    """
+    cache = {'ssid': None, 'bssid': None, 'channel': None, 'ifconfig': list(wlan.ifconfig())}
+    for key in ('ssid', 'bssid', 'channel'):
+        try:
+            value = wlan.config(key)
+            cache[key] = value.hex() if type(value) == bytes else value
+        except Exception:
+            pass # not supported by this firmware
+    if cache['ssid'] is None or cache == glob['wifi_cache']:
+        return
+    glob['wifi_cache'] = cache
+    try:
+        with open(config['wifi_cache'], 'w') as file:
+            json.dump(cache, file)
+    except Exception as e:
+        logger.warning('could not save wifi cache: %s', e)
+
+def wifi_cache_load():
+    if glob['wifi_cache'] is None:
+        try:
+            with open(config['wifi_cache']) as file:
+                glob['wifi_cache'] = json.load(file)
+        except Exception:
+            return None
+    return glob['wifi_cache']
+
+async def wifi_fast_join(wlan):
+    """
+    Joins the cached network directly, without scanning for all networks first.
+        Returns:
+            True if the connection was established
+    """
+    cache = wifi_cache_load()
+    if cache is None:
+        return False
+    password = wifi_password(cache['ssid'])
+    if password is None:
+        return False
+    if config['wifi_static_ip'] and cache['ifconfig']:
+        wlan.ifconfig(tuple(cache['ifconfig'])) # skips dhcp
+    # bssid and channel skip the search for the access point
+    kwargs = {}
+    if cache['bssid']:
+        kwargs['bssid'] = bytes.fromhex(cache['bssid'])
+    if cache['channel']:
+        kwargs['channel'] = cache['channel']
+    try:
+        wlan.connect(cache['ssid'], password, **kwargs)
+    except TypeError: # firmware without the channel argument
+        kwargs.pop('channel', None)
+        wlan.connect(cache['ssid'], password, **kwargs)
+    start = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), start) < config['wifi_fast_timeout'] * 1000:
+        if wlan.isconnected():
+            return True
+        await asyncio.sleep(0.1)
+    wlan.disconnect()
+    if config['wifi_static_ip']:
+        try:
+            wlan.ifconfig('dhcp')
+        except Exception:
+            pass
+    return False
+
+async def wifi_join(wlan, force_reconnect=False):
+    """
+    Connects to the wifi: tries the cached network first and falls back to the scan
+    in `mywlan.connect()`. The time needed is recorded in glob['wifi_stats'] for
+    successful connections, failed attempts are counted in 'failed'.
+        Returns:
+            True if the connection was established
+    """
+    stats = glob['wifi_stats']
+    start = time.ticks_ms()
+    if force_reconnect and wlan.isconnected():
+        wlan.disconnect()
+    if await wifi_fast_join(wlan):
+        path = 'fast'
+    else:
+        if wifi_cache_load() is not None:
+            stats['failed_fast'] += 1
+        mywlan.connect()
+        path = 'scan'
+    elapsed = time.ticks_diff(time.ticks_ms(), start)
+    if not wlan.isconnected():
+        stats['failed'] += 1
+        logger.warning('wifi connection failed after %s ms', elapsed)
+        return False
+    stats[path] += 1
+    stats['last_path'] = path
+    stats['last_ms'] = elapsed
+    logger.info('wifi connected via %s in %s ms', path, elapsed)
+    wifi_cache_save(wlan)
+    return True
+
 async def wifi_conn(wifi_request):
     """
     ### Wifi Management
@@ -68,6 +230,8 @@ async def wifi_conn(wifi_request):
     all networks in the vicinity and compares them with the SSIDs and
     passwords stored in the `mywlan_ssids.json` file. If a known network
     is found, the script attempts to establish a connection.
+    The last working network is cached in `wifi_cache.json` and joined directly
+    first, the scan is only used if that fails (see wifi_join()).
 
         Args:
             wifi_request (bool or str)
@@ -83,14 +247,14 @@ async def wifi_conn(wifi_request):
     global glob
     wlan = glob['wlan']
     if wifi_request == True and not wlan.isconnected():
-            mywlan.connect()
-            logger.info('wifi connection established')
+            if await wifi_join(wlan):
+                logger.info('wifi connection established')
     elif wifi_request == False and wlan.isconnected():
         mywlan.connect(force_disconnect=True)
         logger.info('wifi disconnected')
-    elif wifi_request == 'reconnect' and wlan.isconnected():
-        mywlan.connect(force_reconnect=True)
-        logger.info('wifi reconnected')
+    elif wifi_request == 'reconnect':
+        if await wifi_join(wlan, force_reconnect=True):
+            logger.info('wifi reconnected')
     else:
         # requested already established/disconnected connection. Request will be ignored
         pass
@@ -121,7 +285,7 @@ async def broker_conn_loop(client):
                 await wifi_conn('reconnect')
                 await client.connect()
         except Exception as e:
-            logger.critical(f'could not connect to broker: {e}')
+            logger.critical('could not connect to broker: %s', e)
             asyncio.sleep(10)
             continue
 
@@ -163,7 +327,7 @@ async def register_callback(topic, msg, retained, qos, dup):
     
     topic = topic.decode('utf-8')
     msg = msg.decode('utf-8')
-    logger.debug(f'recieved mqtt message at {topic}, Payload: {msg}')
+    logger.debug('recieved mqtt message at %s, Payload: %s', topic, msg)
 
     try:
         # measuring station recieves its board_id here, regsitration within the database
@@ -172,7 +336,7 @@ async def register_callback(topic, msg, retained, qos, dup):
             logger.debug('board_id set')
 
     except Exception as e:
-        logger.warning(f'error in register_callback: {e}')
+        logger.warning('error in register_callback: %s', e)
 
 async def register_message(register_client):
     """
@@ -188,7 +352,7 @@ async def register_message(register_client):
         topic = f"{glob['topic_prefix']}/board_register/{glob['mac_addr']}"
         payload = glob['mac_addr'].encode('utf-8')
         await register_client.publish(topic, payload)
-        logger.debug(f'Publish at {topic}, Payload: {payload}')
+        logger.debug('Publish at %s, Payload: %s', topic, payload)
         await asyncio.sleep(10)
 
 async def register_loop(register_client):
@@ -221,10 +385,12 @@ async def register_config():
     glob['mac_addr'] = mac_addr
     glob['wlan'] = wlan
     await wifi_conn(True)
-    try:
-        ntp_sync()
-    except:
-        logger.warning('NTP time failed')
+    boot.mark('wifi')
+    # start with the cached clock, ntp refines it in the background
+    if not sync_time.restore():
+        logger.warning('no cached time available')
+    asyncio.create_task(sync_time.sync_task(config['ntp_interval'], config['ntp_timeout']))
+    boot.mark('ntp')
 
     register_config['server'] = config['mqtt_server']
     register_config['port'] = config['mqtt_port']
@@ -247,12 +413,14 @@ async def register_config():
     logger.debug('connection to broker successful')
     logger.info('start registration process')
     await asyncio.gather(register_loop(register_client), register_message(register_client))
+    boot.mark('registration')
 
 asyncio.get_event_loop().run_until_complete(register_config())
 
 # start of mainly used loop for mqtt communication and measurement
-time.sleep(5) # to make sure to be disconnected from broker
+time.sleep(config['boot_settle']) # to make sure to be disconnected from broker
 gc.collect()
+boot.mark('settle')
 
 # ----------------------------
 # MQTT: start of main function
@@ -265,6 +433,7 @@ async def init_hw():
     global glob
     i2c = I2C(id=0, scl=Pin(17), sda=Pin(16), freq=400000)
     try:
+        from mcp4725 import MCP4725
         glob['dac_ds'] = MCP4725(i2c=i2c, address=98)
         glob['dac_gs'] = MCP4725(i2c=i2c, address=99)
         glob['dac_ds'].write(0)
@@ -273,6 +442,7 @@ async def init_hw():
         print('no hardware found, change into emulation mode')
         glob['dac_ds'] = None
         glob['dac_gs'] = None
+    glob['cal'] = calib.Calibration.load(config['cal_file'])
     glob['btn_1'] = Pin(0, Pin.IN, Pin.PULL_UP)
     glob['btn_2'] = Pin(1, Pin.IN, Pin.PULL_UP)
     glob['btn_3'] = Pin(2, Pin.IN, Pin.PULL_UP)
@@ -308,22 +478,7 @@ async def reserve_buffer(size, buffer):
         raise MemoryError("Kein freier Speicher mehr im globalen Puffer")
     return start, end
 
-async def reshape_buffer(buffer_slice: array.array):
-    start_idx = 0
-    reshaped = []
-    for idx, value in enumerate(buffer_slice):
-            if value == 0.0: # no value found
-                pass
-            elif value == 5.0: # stop value found (will be written if break_bool = True)
-                if idx > start_idx:
-                    reshaped.append(buffer_slice[start_idx:idx])
-                start_idx = idx+1
-            elif value == 10.0: # initial ending value
-                break
-    return reshaped
-
-
-async def meas(topic_dict: dict, value_dict: dict, client):
+async def meas(topic_dict: dict, value_dict: dict, client, zero=True):
     """
     ### Main measurement funciton. Description tba
 
@@ -341,7 +496,8 @@ async def meas(topic_dict: dict, value_dict: dict, client):
 
         * for meas_type 4: list of [start, step, stop] for both u_gs and u_ds is needed
             * example: {'U_DS': [value_1, value_2, ...], 'U_GS': [value_1, value_2, ...]}
-    
+
+    With zero=False the DACs keep their last value, e.g. between the jobs of a batch.
     """
 
     global glob
@@ -356,10 +512,10 @@ async def meas(topic_dict: dict, value_dict: dict, client):
     adc_ds = ADC(Pin(26))
     adc_gs = ADC(Pin(27))
     adc_Ib = ADC(Pin(28))
-    multi_Ib = 9800/4600
-    adcMax = 2**16 # 16 Bit
-    adcVDD = 3.3   # Volt
-    U_1 = 4095/adcVDD # reference-value for dac's: is used to iterate over 4095 states for Voltages fom 0 to 3.3 V
+    # calibrated conversion: DAC codes are precomputed, the raw ADC readings are summed as
+    # integers and converted once per point
+    cal = glob['cal']
+    ib_limit = cal.raw_limit('ib', 0.1)
     
     topic = f"{glob['topic_prefix']}/Einzeln/{username}/{time_stamp}/{board_id}/{meas_type}"
     break_bool = False
@@ -367,21 +523,21 @@ async def meas(topic_dict: dict, value_dict: dict, client):
     if meas_type == 'Single-Measurement':
         multi = value_dict.get('multi', 1)
         break_bool = False
-        dac_gs.write(int(value_dict['U_GS'] * U_1))
-        dac_ds.write(int(value_dict['U_DS'] * U_1))
+        dac_gs.write(cal.dac_code('gs', value_dict['U_GS']))
+        dac_ds.write(cal.dac_code('ds', value_dict['U_DS']))
         adc_ds_sum, adc_gs_sum, Ib_current_sum = 0, 0, 0
         for _ in range(multi):
-            adc_ds_sum += adc_ds.read_u16() * adcVDD / adcMax
-            adc_gs_sum += adc_gs.read_u16() * adcVDD / adcMax
-            adc_opv_value = adc_Ib.read_u16() * adcVDD / adcMax
-            Ib_current_sum += (adc_opv_value / multi_Ib) / 7.8
-            if (adc_opv_value / multi_Ib) / 7.8 > 0.1: # checks if any Ib_current > 0.1 A
+            adc_ds_sum += adc_ds.read_u16()
+            adc_gs_sum += adc_gs.read_u16()
+            Ib_raw = adc_Ib.read_u16()
+            Ib_current_sum += Ib_raw
+            if Ib_raw > ib_limit: # checks if any Ib_current > 0.1 A
                 break_bool = True
                 return {'U_DS': '', 'U_GS': '', 'I_D': '', 'break_bool': break_bool}
             # calculate average values
-        ds_av_value = adc_ds_sum / multi
-        gs_av_value = adc_gs_sum / multi
-        Ib_av_value = Ib_current_sum / multi
+        ds_av_value = cal.convert('ds', adc_ds_sum / multi)
+        gs_av_value = cal.convert('gs', adc_gs_sum / multi)
+        Ib_av_value = cal.convert('ib', Ib_current_sum / multi)
         return_dict = {'U_DS': ds_av_value, 'U_GS': gs_av_value, 'I_D': Ib_av_value, 'break_bool': break_bool}
         gc.collect()
     
@@ -390,27 +546,28 @@ async def meas(topic_dict: dict, value_dict: dict, client):
         needed_size = len(value_dict['U_DS'])
         start, end = await reserve_buffer(needed_size, glob['ds_array']) # any buffer to check if there is enough space for all values
         idx = start # = 0
-        dac_gs.write(int(value_dict['U_GS'] * U_1))
-        for ds_value in value_dict['U_DS']:
-            dac_ds.write(int(ds_value * U_1))
+        ds_codes = cal.dac_codes('ds', value_dict['U_DS'])
+        dac_gs.write(cal.dac_code('gs', value_dict['U_GS']))
+        for ds_code in ds_codes:
+            dac_ds.write(ds_code)
             time.sleep(0.1) # Wait a little...
             # init / reset sum variables
             adc_ds_sum, adc_gs_sum, Ib_current_sum = 0, 0, 0
             for _ in range(multi):
-                adc_ds_sum += adc_ds.read_u16() * adcVDD / adcMax
-                adc_gs_sum += adc_gs.read_u16() * adcVDD / adcMax
-                adc_opv_value = adc_Ib.read_u16() * adcVDD / adcMax
-                Ib_current_sum += (adc_opv_value / multi_Ib) / 7.8
-                if (adc_opv_value / multi_Ib) / 7.8 > 0.1: # checks if any Ib_current > 0.1 A
+                adc_ds_sum += adc_ds.read_u16()
+                adc_gs_sum += adc_gs.read_u16()
+                Ib_raw = adc_Ib.read_u16()
+                Ib_current_sum += Ib_raw
+                if Ib_raw > ib_limit: # checks if any Ib_current > 0.1 A
                     break_bool = True
                     break
             # calculate average values
             if break_bool:
                 break
             # calculate average values
-            ds_av_value = adc_ds_sum / multi
-            gs_av_value = adc_gs_sum / multi
-            Ib_av_value = Ib_current_sum / multi
+            ds_av_value = cal.convert('ds', adc_ds_sum / multi)
+            gs_av_value = cal.convert('gs', adc_gs_sum / multi)
+            Ib_av_value = cal.convert('ib', Ib_current_sum / multi)
             # save those variables to the corresponding arrays
             glob['ds_array'][idx] = ds_av_value
             glob['gs_array'][idx] = gs_av_value
@@ -419,41 +576,42 @@ async def meas(topic_dict: dict, value_dict: dict, client):
             # Publish for every loop iteration
             payload = json.dumps({'U_DS': ds_av_value, 'U_GS': gs_av_value, 'I_D': Ib_av_value}).encode('utf-8')
             await client.publish(topic, payload)
-            logger.debug(f'Publish at {topic}, Payload: {payload}')
+            logger.debug('Publish at %s, Payload: %s', topic, payload)
 
         main_ds_list = list(glob['ds_array'][start:idx])
         main_gs_list = list(glob['gs_array'][start:idx])
         main_ib_list = list(glob['ib_array'][start:idx])
         return_dict = {'U_DS': main_ds_list, 'U_GS': main_gs_list, 'I_D': main_ib_list, 'break_bool': break_bool}
-        logger.debug(f'Bevore allocation: {gc.mem_free()/1000} kB')
+        logger.debug('Bevore allocation: %s kB', gc.mem_free()/1000)
         gc.collect()
-        logger.debug(f'After allocation: {gc.mem_free()/1000} kB')
+        logger.debug('After allocation: %s kB', gc.mem_free()/1000)
 
     elif topic_dict['meas_type'] == 'Gate-Source-Sweep':
         multi = value_dict.get('multi', 1)
         needed_size = len(value_dict['U_GS'])
         start, end = await reserve_buffer(needed_size, glob['ds_array']) # any buffer to check if there is enough space for all values
         idx = start # = 0
-        dac_ds.write(int(value_dict['U_DS'] * U_1))
-        for gs_value in value_dict['U_GS']:
-            dac_gs.write(int(gs_value * U_1))
+        gs_codes = cal.dac_codes('gs', value_dict['U_GS'])
+        dac_ds.write(cal.dac_code('ds', value_dict['U_DS']))
+        for gs_code in gs_codes:
+            dac_gs.write(gs_code)
             time.sleep(0.1) # Wait a little...
             # init / reset sum variables
             adc_ds_sum, adc_gs_sum, Ib_current_sum = 0, 0, 0
             for _ in range(multi):
-                adc_ds_sum += adc_ds.read_u16() * adcVDD / adcMax
-                adc_gs_sum += adc_gs.read_u16() * adcVDD / adcMax
-                adc_opv_value = adc_Ib.read_u16() * adcVDD / adcMax
-                Ib_current_sum += (adc_opv_value / multi_Ib) / 7.8
-                if (adc_opv_value / multi_Ib) / 7.8 > 0.1: # checks if any Ib_current > 0.1 A
+                adc_ds_sum += adc_ds.read_u16()
+                adc_gs_sum += adc_gs.read_u16()
+                Ib_raw = adc_Ib.read_u16()
+                Ib_current_sum += Ib_raw
+                if Ib_raw > ib_limit: # checks if any Ib_current > 0.1 A
                     break_bool = True
                     break
             if break_bool:
                     break
             # calculate average values
-            ds_av_value = adc_ds_sum / multi
-            gs_av_value = adc_gs_sum / multi
-            Ib_av_value = Ib_current_sum / multi
+            ds_av_value = cal.convert('ds', adc_ds_sum / multi)
+            gs_av_value = cal.convert('gs', adc_gs_sum / multi)
+            Ib_av_value = cal.convert('ib', Ib_current_sum / multi)
             # save those variables to the corresponding arrays
             glob['ds_array'][idx] = ds_av_value
             glob['gs_array'][idx] = gs_av_value
@@ -462,15 +620,15 @@ async def meas(topic_dict: dict, value_dict: dict, client):
             # Publish for every loop iteration
             payload = json.dumps({'U_DS': ds_av_value, 'U_GS': gs_av_value, 'I_D': Ib_av_value}).encode('utf-8')
             await client.publish(topic, payload)
-            logger.debug(f'Publish at {topic}, Payload: {payload}')
+            logger.debug('Publish at %s, Payload: %s', topic, payload)
 
         main_ds_list = list(glob['ds_array'][start:idx])
         main_gs_list = list(glob['gs_array'][start:idx])
         main_ib_list = list(glob['ib_array'][start:idx])
         return_dict = {'U_DS': main_ds_list, 'U_GS': main_gs_list, 'I_D': main_ib_list, 'break_bool': break_bool}
-        logger.debug(f'Bevore allocation: {gc.mem_free()/1000} kB')
+        logger.debug('Bevore allocation: %s kB', gc.mem_free()/1000)
         gc.collect()
-        logger.debug(f'After allocation: {gc.mem_free()/1000} kB')
+        logger.debug('After allocation: %s kB', gc.mem_free()/1000)
     
     elif topic_dict['meas_type'] == 'Combined-Sweep':
         multi = value_dict.get('multi', 1)
@@ -479,35 +637,36 @@ async def meas(topic_dict: dict, value_dict: dict, client):
         needed_size = outer_len * inner_len
         start, end = await reserve_buffer(needed_size, glob['ds_array']) # any buffer to check if there is enough space for all values
         idx = start # = 0
+        # the codes of the inner loop are the same for every row
+        gs_codes = cal.dac_codes('gs', value_dict['U_GS'])
+        ds_codes = cal.dac_codes('ds', value_dict['U_DS'])
         # for gs_value in value_dict['U_GS']:
-        for gs_value in value_dict['U_GS']:
+        row_bounds = []
+        for gs_idx, gs_value in enumerate(value_dict['U_GS']):
             break_flag = False
+            row_start = idx
             # we need to make sure that all of our used list in those loops are ready for new data
-            dac_gs.write(int(gs_value * U_1))
-            for ds_value in value_dict['U_DS']:
-                dac_ds.write(int(ds_value * U_1))
+            dac_gs.write(gs_codes[gs_idx])
+            for ds_code in ds_codes:
+                dac_ds.write(ds_code)
                 time.sleep(0.1) # Wait a little...
                 # init / reset sum variables
                 adc_ds_sum, adc_gs_sum, Ib_current_sum = 0, 0, 0
                 for _ in range(multi):
-                    adc_ds_sum += adc_ds.read_u16() * adcVDD / adcMax
-                    adc_gs_sum += adc_gs.read_u16() * adcVDD / adcMax
-                    adc_opv_value = adc_Ib.read_u16() * adcVDD / adcMax
-                    Ib_current_sum += (adc_opv_value / multi_Ib) / 7.8
-                    if (adc_opv_value / multi_Ib) / 7.8 > 0.1: # checks if any Ib_current > 0.1 A
+                    adc_ds_sum += adc_ds.read_u16()
+                    adc_gs_sum += adc_gs.read_u16()
+                    Ib_raw = adc_Ib.read_u16()
+                    Ib_current_sum += Ib_raw
+                    if Ib_raw > ib_limit: # checks if any Ib_current > 0.1 A
                         break_bool = True
                         break_flag = True
                         break
                 if break_flag:
-                    glob['ds_array'][idx] = 5.0
-                    glob['gs_array'][idx] = 5.0
-                    glob['ib_array'][idx] = 5.0
-                    idx += 1
                     break
                 # calculate average values
-                ds_av_value = adc_ds_sum / multi
-                gs_av_value = adc_gs_sum / multi
-                Ib_av_value = Ib_current_sum / multi
+                ds_av_value = cal.convert('ds', adc_ds_sum / multi)
+                gs_av_value = cal.convert('gs', adc_gs_sum / multi)
+                Ib_av_value = cal.convert('ib', Ib_current_sum / multi)
                 # save those variables to the corresponding arrays
                 glob['ds_array'][idx] = ds_av_value
                 glob['gs_array'][idx] = gs_av_value
@@ -516,37 +675,486 @@ async def meas(topic_dict: dict, value_dict: dict, client):
                 # Publish for every loop iteration
                 payload = json.dumps({'U_DS': ds_av_value, 'U_GS': gs_av_value, 'I_D': Ib_av_value, 'U_GS_selected': gs_value}).encode('utf-8')
                 await client.publish(topic, payload)
-                logger.debug(f'Publish at {topic}, Payload: {payload}')
-            # we need to mark the end of a loop iteration
-            glob['ds_array'][idx] = 5.0
-            glob['gs_array'][idx] = 5.0
-            glob['ib_array'][idx] = 5.0
-            idx += 1
-            logger.debug(f'Bevore allocation: {gc.mem_free()/1000} kB')
+                logger.debug('Publish at %s, Payload: %s', topic, payload)
+            # remember where the row ends, it may be empty after an over-current
+            row_bounds.append((row_start, idx))
+            logger.debug('Bevore allocation: %s kB', gc.mem_free()/1000)
             gc.collect()
-            logger.debug(f'After allocation: {gc.mem_free()/1000} kB')
-        glob['ds_array'][idx] = 10.0
-        glob['gs_array'][idx] = 10.0
-        glob['ib_array'][idx] = 10.0
-        main_ds_list = await reshape_buffer(glob['ds_array'][start:idx])
-        main_gs_list = await reshape_buffer(glob['gs_array'][start:idx])
-        main_ib_list = await reshape_buffer(glob['ib_array'][start:idx])
+            logger.debug('After allocation: %s kB', gc.mem_free()/1000)
+        # one row per U_GS value, so row i always belongs to U_GS[i] (and to row_index[i] of a shard)
+        main_ds_list = [list(glob['ds_array'][row_start:row_end]) for row_start, row_end in row_bounds]
+        main_gs_list = [list(glob['gs_array'][row_start:row_end]) for row_start, row_end in row_bounds]
+        main_ib_list = [list(glob['ib_array'][row_start:row_end]) for row_start, row_end in row_bounds]
         return_dict = {'U_DS': main_ds_list, 'U_GS': main_gs_list, 'I_D': main_ib_list, 'break_bool': break_bool}
     else:
         return 'unknown measurement type'
     # sustain output low if the measurement is done
-    dac_gs.write(0)
-    dac_ds.write(0)
+    if zero:
+        dac_gs.write(0)
+        dac_ds.write(0)
     logger.debug('meas_task complete')
     return return_dict 
 
+async def meas_dual_core(topic_dict: dict, value_dict: dict, client, zero=True):
+    """
+    ### Dual-core measurement
+
+    Same arguments and results as meas() for the sweep types. The DACs and ADCs are driven
+    by `sampler.sample_worker()` on the second core, which writes the points into a ring
+    buffer. This coroutine drains the buffer and publishes every point, so acquisition and
+    network I/O overlap.
+    """
+    import sampler
+    global glob
+    username = topic_dict['username']
+    meas_type = topic_dict['meas_type']
+    time_stamp = topic_dict['time_stamp']
+    board_id = glob['board_id']
+    multi = value_dict.get('multi', 1)
+
+    topic = f"{glob['topic_prefix']}/Einzeln/{username}/{time_stamp}/{board_id}/{meas_type}"
+    combined = meas_type == 'Combined-Sweep'
+
+    async def publish_point(row, ds_value, gs_value, ib_value):
+        point = {'U_DS': ds_value, 'U_GS': gs_value, 'I_D': ib_value}
+        if combined:
+            point['U_GS_selected'] = value_dict['U_GS'][row]
+        payload = json.dumps(point).encode('utf-8')
+        await client.publish(topic, payload)
+        logger.debug('Publish at %s, Payload: %s', topic, payload)
+
+    if glob['ring'] is None:
+        glob['ring'] = sampler.RingBuffer(config['ring_size'])
+    backend = sampler.HwBackend(glob['dac_ds'], glob['dac_gs'], ADC(Pin(26)), ADC(Pin(27)), ADC(Pin(28)), glob['cal'])
+    await sampler.start(glob['ring'], backend, sampler.rows(meas_type, value_dict), multi, zero=zero)
+    main_ds_list, main_gs_list, main_ib_list, break_bool = await sampler.collect(glob['ring'], publish_point)
+    if not combined:
+        main_ds_list, main_gs_list, main_ib_list = main_ds_list[0], main_gs_list[0], main_ib_list[0]
+    gc.collect()
+    logger.debug('meas_dual_core complete')
+    return {'U_DS': main_ds_list, 'U_GS': main_gs_list, 'I_D': main_ib_list, 'break_bool': break_bool}
+
+async def time_series(topic_dict: dict, value_dict: dict, client):
+    """
+    ### Continuous time-series acquisition
+
+    Holds U_GS and U_DS and samples the three ADC channels with a fixed rate (see
+    `sampler.TimerSampler`). The samples are folded into running min, sum and max, every
+    `window` samples one frame with [min, mean, max] per channel is published on the
+    `Einzeln` topic, so memory depends neither on the duration nor on the window.
+    Every frame carries the ticks_us `t` and the wall clock `time` (integer ms since the
+    epoch) of its first sample. Runs as its own task and stops after `duration` seconds, on a
+    message at `<prefix>/Stop/<board_id>` or on over-current. A summary is published on
+    the `Paket` topic at the end.
+
+        * example: {'U_DS': 2.0, 'U_GS': 2.2, 'rate': 100, 'window': 100, 'duration': 3600}
+        * rate in Hz (default 100), window in samples (default: 1 s), duration in s (default: until stopped)
+    """
+    import sampler
+    global glob
+    username = topic_dict['username']
+    meas_type = topic_dict['meas_type']
+    time_stamp = topic_dict['time_stamp']
+    board_id = glob['board_id']
+    rate = value_dict.get('rate', 100)
+    window = value_dict.get('window', rate)
+    duration = value_dict.get('duration', None)
+
+    topic = f"{glob['topic_prefix']}/Einzeln/{username}/{time_stamp}/{board_id}/{meas_type}"
+    condition_topic = f"{glob['topic_prefix']}/Zustand_Messplatz/{board_id}"
+    hardware = glob['dac_gs'] and glob['dac_ds']
+    if hardware:
+        backend = sampler.HwBackend(glob['dac_ds'], glob['dac_gs'], ADC(Pin(26)), ADC(Pin(27)), ADC(Pin(28)), glob['cal'])
+    else:
+        backend = sampler.SimBackend()
+    frame_buf = sampler.FrameBuffer(window)
+    timer_sampler = sampler.TimerSampler(frame_buf, backend, rate)
+    # poll often enough to react to Stop and the duration, also for long windows
+    poll = min(window / rate / 2, 0.2)
+    frames, samples = 0, 0
+    glob['stream_stop'] = False
+    try:
+        backend.set_gs(value_dict['U_GS'])
+        backend.set_ds(value_dict['U_DS'])
+        await asyncio.sleep(0.1) # Wait a little...
+        start = time.ticks_ms()
+        timer_sampler.start()
+        while True:
+            stop = glob['stream_stop'] or timer_sampler.over_current
+            if duration is not None and time.ticks_diff(time.ticks_ms(), start) >= duration * 1000:
+                stop = True
+            if stop:
+                timer_sampler.stop()
+                frame_buf.close() # publish the incomplete last frame, too
+            while True:
+                frame = frame_buf.get()
+                if frame is None:
+                    break
+                frame['time'] = sync_time.ticks_to_ms(frame['t'])
+                frames += 1
+                samples += frame['n']
+                payload = json.dumps(frame).encode('utf-8')
+                await client.publish(topic, payload)
+                logger.debug('Publish at %s, Payload: %s', topic, payload)
+            if stop:
+                break
+            await asyncio.sleep(poll)
+    except Exception as e:
+        # no main_callback around this task: report the error like main_callback does
+        debug_topic = f"{glob['topic_prefix']}/debug/{board_id}"
+        payload = f'An Error occured: {e}'.encode('utf-8')
+        await client.publish(debug_topic, payload)
+        logger.error('Error in time series: %s', e)
+        payload = 'ready'.encode('utf-8')
+        await client.publish(condition_topic, payload)
+        return
+    finally:
+        timer_sampler.stop()
+        if hardware:
+            backend.zero()
+        glob['stream_task'] = None
+
+    result = {'rate': rate, 'window': window, 'frames': frames, 'samples': samples,
+              'dropped': frame_buf.dropped, 'break_bool': timer_sampler.over_current}
+    data_path = f"{username}/{time_stamp}/{board_id}/{meas_type}"
+    await publish_or_spool(client, data_path, result)
+    payload = 'ready'.encode('utf-8')
+    await client.publish(condition_topic, payload)
+    logger.debug('Publish at %s, Payload: %s', condition_topic, payload)
+
+async def emu_meas(topic_dict: dict, value_dict: dict, client, rows=None):
+    """
+    ### Emulated measurement
+
+    Runs the emulation from `hw_emu.dac_stream()` point by point and publishes every
+    point on the `Einzeln` topic, just like meas() does on real hardware. Only the final
+    result lists are built, the emulator itself does not hold any intermediate lists.
+    Takes the same arguments as `hw_emu.dac()`, `rows` limits a Combined-Sweep to these rows.
+    The hardware names of the measurement types are accepted, the old emulation names
+    (SingleMeasurement, CombinedSweep) as well.
+    """
+    from hw_emu import dac_stream as emu_stream, MEAS_TYPES as EMU_MEAS_TYPES, SETTLE_TIME as EMU_SETTLE_TIME, meas_type_name
+    global glob
+    username = topic_dict['username']
+    meas_type = topic_dict['meas_type']
+    time_stamp = topic_dict['time_stamp']
+    board_id = glob['board_id']
+
+    topic = f"{glob['topic_prefix']}/Einzeln/{username}/{time_stamp}/{board_id}/{meas_type}"
+    break_bool = False
+    combined = meas_type_name(meas_type) == 'Combined-Sweep'
+    main_ds_list, main_gs_list, main_ib_list = [], [], []
+    ds_row, gs_row, ib_row = main_ds_list, main_gs_list, main_ib_list
+    current_row = -1
+    skip_row = -1
+
+    if meas_type not in EMU_MEAS_TYPES:
+        return 'unknown measurement type'
+    for row, ds_value, gs_value, ib_value in emu_stream(topic_dict, value_dict, rows):
+        if meas_type_name(meas_type) == 'Single-Measurement':
+            return {'U_DS': ds_value, 'U_GS': gs_value, 'I_D': ib_value, 'break_bool': ib_value > 0.1}
+        if row == skip_row:
+            continue
+        if combined and row != current_row:
+            # new U_GS value: start a new row in the result
+            current_row = row
+            ds_row, gs_row, ib_row = [], [], []
+            main_ds_list.append(ds_row)
+            main_gs_list.append(gs_row)
+            main_ib_list.append(ib_row)
+            gc.collect()
+        await asyncio.sleep(EMU_SETTLE_TIME) # Wait a little, like the hardware does...
+        if ib_value > 0.1: # checks if any Ib_current > 0.1 A
+            break_bool = True
+            if not combined:
+                break
+            skip_row = row # skip the rest of this row, like the hardware does
+            continue
+        ds_row.append(ds_value)
+        gs_row.append(gs_value)
+        ib_row.append(ib_value)
+        # Publish for every loop iteration
+        point = {'U_DS': ds_value, 'U_GS': gs_value, 'I_D': ib_value}
+        if combined:
+            point['U_GS_selected'] = gs_value
+        payload = json.dumps(point).encode('utf-8')
+        await client.publish(topic, payload)
+        logger.debug('Publish at %s, Payload: %s', topic, payload)
+
+    logger.debug('emu_meas complete')
+    return {'U_DS': main_ds_list, 'U_GS': main_gs_list, 'I_D': main_ib_list, 'break_bool': break_bool}
+
+async def publish_chunks(client, transfer, indices=None):
+    """
+    Encodes the result of a chunked transfer again and publishes the chunks with the
+    given indices (all if None). Only one chunk is in memory at a time.
+        Args:
+            * client (client-object)
+            * transfer (dict): see publish_result()
+            * indices (list of int)
+        Returns:
+            chunker.ChunkStream, for the manifest; transfer['length'] is the uncompressed size
+    """
+    import chunker
+    chunk_topic = f"{glob['topic_prefix']}/Paket_Chunk/{transfer['path']}"
+    stream = chunker.ChunkStream(transfer['chunk_size'], transfer['id'])
+    stats = {}
+    for piece in chunker.encode(transfer['result'], transfer['compression'] is not None, stats):
+        for idx, payload in stream.feed(piece):
+            if indices is None or idx in indices:
+                await client.publish(chunk_topic, payload)
+                logger.debug('Publish at %s, chunk %s', chunk_topic, idx)
+    for idx, payload in stream.finish():
+        if indices is None or idx in indices:
+            await client.publish(chunk_topic, payload)
+            logger.debug('Publish at %s, chunk %s', chunk_topic, idx)
+    transfer['length'] = stats['length']
+    return stream
+
+async def publish_manifest(client, transfer):
+    """
+    Publishes the manifest of a chunked transfer with QoS 1, it is the only message
+    with the number of chunks and the crc of the transfer.
+    """
+    manifest_topic = f"{glob['topic_prefix']}/Paket_Manifest/{transfer['path']}"
+    await client.publish(manifest_topic, json.dumps(transfer['manifest']).encode('utf-8'), qos=1)
+    logger.debug('Publish at %s, Payload: %s', manifest_topic, transfer['manifest'])
+
+async def publish_result(client, path, result):
+    """
+    ### Publishes a measurement result
+
+    Small results are published as one message on the `Paket` topic. Bigger results
+    (more than `config['chunk_threshold']` bytes) are encoded row by row and cut into
+    numbered chunks with their own crc, so the complete json string is never built:
+    * the chunks are published on `<prefix>/Paket_Chunk/<path>`, every chunk header carries
+      the transfer id, see chunker.ChunkStream
+    * then a manifest (json) with number of chunks and crc is published with QoS 1 on
+      `<prefix>/Paket_Manifest/<path>`
+
+    Missing chunks can be requested on `<prefix>/Paket_Resend/<board_id>` with a json
+    message {'id': transfer_id, 'chunks': [idx, ...]} for `config['resend_timeout']` seconds.
+    Without `chunks` (or with an empty list) the manifest is sent again.
+        Args:
+            * client (client-object)
+            * path (str): username/time_stamp/board_id/meas_type
+            * result (dict, str or bytes)
+    """
+    import chunker
+    global glob
+    # encode until the result turns out to be too big for one message
+    head = bytearray()
+    for piece in chunker.encode(result):
+        head += piece
+        if len(head) > config['chunk_threshold']:
+            break
+    else:
+        data_topic = f"{glob['topic_prefix']}/Paket/{path}"
+        payload = bytes(head)
+        await client.publish(data_topic, payload)
+        logger.debug('Publish at %s, Payload: %s', data_topic, payload)
+        return
+    head = None
+
+    glob['last_transfer'] = None # release the previous transfer
+    glob['transfer_id'] = (glob['transfer_id'] + 1) & 0xFFFF # 16 bit in the chunk header
+    transfer = {
+        'id': glob['transfer_id'],
+        'path': path,
+        'result': result,
+        'chunk_size': config['chunk_size'],
+        'compression': 'zlib' if config['compress'] and chunker.can_compress() else None,
+    }
+    stream = await publish_chunks(client, transfer)
+    transfer['manifest'] = chunker.manifest(transfer['id'], stream, transfer['chunk_size'],
+                                            length=transfer['length'], compression=transfer['compression'])
+    await publish_manifest(client, transfer)
+    # the result is kept for resend requests until the timeout, see mqtt_task()
+    transfer['expires'] = time.ticks_add(time.ticks_ms(), config['resend_timeout'] * 1000)
+    glob['last_transfer'] = transfer
+
+async def publish_or_spool(client, path, result):
+    """
+    Publishes a result with publish_result(). If the broker is not reachable the
+    result is appended to the offline spool and replayed later by replay_spool().
+    """
+    global glob
+    if client._state == 1:
+        try:
+            await publish_result(client, path, result)
+            return
+        except Exception as e:
+            logger.warning('could not publish result: %s', e)
+    if type(result) == dict:
+        result = json.dumps(result)
+    if type(result) == str:
+        result = result.encode('utf-8')
+    glob['spool'].append(path, result)
+    logger.warning('result %s spooled', path)
+
+async def replay_spool(client):
+    """
+    Publishes the spooled results in batches, rate limited by config['spool_interval'].
+    Stops when the spool is empty or the connection is lost again.
+    New results may be spooled (and old ones evicted) while a batch is sent, so the sent
+    records are dropped by count, minus the ones that were evicted in the meantime.
+    """
+    global glob
+    if glob['spool_replay']:
+        return
+    glob['spool_replay'] = True
+    try:
+        while client._state == 1:
+            removed = glob['spool'].removed
+            batch, _ = glob['spool'].read_batch(config['spool_batch'])
+            if not batch:
+                break
+            for path, payload in batch:
+                await publish_result(client, path, payload)
+                await asyncio.sleep(config['spool_interval'])
+            glob['spool'].drop_records(len(batch) - (glob['spool'].removed - removed))
+            batch = None
+            gc.collect()
+            logger.info('replayed spooled results, %s bytes left', glob['spool'].size())
+    except Exception as e:
+        logger.warning('spool replay interrupted: %s', e)
+    finally:
+        glob['spool_replay'] = False
+
+async def run_meas(topic_dict: dict, value_dict: dict, client, zero=True):
+    """
+    Runs one measurement with meas(), meas_dual_core() or emu_meas(),
+    depending on the available hardware and config['dual_core'].
+
+    A Combined-Sweep can be sharded across several boards: with `value_dict['shard']`
+    (see shard.select_rows()) only a part of the U_GS rows is measured and the result
+    gets the metadata `shard` with the `row_index` of every returned row.
+    """
+    meas_type = topic_dict['meas_type']
+    spec = value_dict.get('shard')
+    rows = None
+    hardware = glob['dac_gs'] and glob['dac_ds']
+    if spec is not None and meas_type in ('Combined-Sweep', 'CombinedSweep'):
+        import shard
+        if hardware:
+            rows = shard.select_rows(len(value_dict['U_GS']), spec)
+            value_dict = dict(value_dict)
+            value_dict['U_GS'] = [value_dict['U_GS'][row] for row in rows]
+        else:
+            from hw_emu import axis_len
+            rows = shard.select_rows(axis_len(value_dict['U_GS']), spec)
+
+    # checks whether hardware is available or whether emulation is required
+    if hardware:
+        if config['dual_core'] and meas_type in ('Drain-Source-Sweep', 'Gate-Source-Sweep', 'Combined-Sweep'):
+            result = await meas_dual_core(topic_dict, value_dict, client, zero)
+        else:
+            result = await meas(topic_dict, value_dict, client, zero)
+    else:
+        result = await emu_meas(topic_dict, value_dict, client, rows)
+
+    if rows is not None and type(result) == dict:
+        result['shard'] = dict(spec)
+        result['shard']['row_index'] = rows
+    return result
+
+def batch_setpoints(job):
+    """
+    First and last (U_GS, U_DS) setpoint of a hardware job, None if unknown.
+    Taken straight from the value lists, in the order meas() runs them.
+    """
+    if 'shard' in job: # the rows are selected in meas()
+        return None
+    meas_type = job['meas_type']
+    try:
+        u_gs, u_ds = job['U_GS'], job['U_DS']
+        if meas_type == 'Single-Measurement':
+            return (u_gs, u_ds), (u_gs, u_ds)
+        if meas_type == 'Drain-Source-Sweep':
+            return (u_gs, u_ds[0]), (u_gs, u_ds[-1])
+        if meas_type == 'Gate-Source-Sweep':
+            return (u_gs[0], u_ds), (u_gs[-1], u_ds)
+        if meas_type == 'Combined-Sweep':
+            return (u_gs[0], u_ds[0]), (u_gs[-1], u_ds[-1])
+    except (KeyError, IndexError, TypeError):
+        pass
+    return None
+
+def batch_compatible(job, next_job):
+    """
+    True if `next_job` starts at the setpoint where `job` ends, so the bias can be held.
+    """
+    this, following = batch_setpoints(job), batch_setpoints(next_job)
+    return this is not None and following is not None and this[1] == following[0]
+
+async def run_batch(topic_dict: dict, jobs, client):
+    """
+    ### Batch of measurements
+
+    Runs several measurements back to back for one request. Between two compatible jobs
+    (the next one starts at the setpoint where the previous one ended) the DACs are not
+    reset to 0 V, otherwise they are. After the last job, after an over-current (the
+    remaining jobs are skipped then) and after an error they are always reset.
+
+        * example: {'jobs': [{'meas_type': 'Single-Measurement', 'U_DS': 2.0, 'U_GS': 2.2},
+                             {'meas_type': 'Drain-Source-Sweep', 'U_DS': [0, 0.5, 1.0], 'U_GS': 2.0}]}
+        * a plain list of jobs is accepted as well
+
+        Returns:
+            {'jobs': [{'index': 0, 'meas_type': ..., 'result': ...}, ...], 'break_bool': bool}
+    """
+    if type(jobs) == dict:
+        jobs = jobs['jobs']
+    results = []
+    break_bool = False
+    try:
+        for index, job in enumerate(jobs):
+            meas_type = job['meas_type']
+            if meas_type in ('Batch', 'Time-Series'):
+                result = 'unknown measurement type'
+            else:
+                job_dict = {
+                    'username': topic_dict['username'],
+                    'time_stamp': topic_dict['time_stamp'],
+                    'meas_type': meas_type
+                }
+                zero = index == len(jobs) - 1 or not batch_compatible(job, jobs[index + 1])
+                result = await run_meas(job_dict, job, client, zero=zero)
+            results.append({'index': index, 'meas_type': meas_type, 'result': result})
+            if type(result) == dict and result['break_bool']:
+                break_bool = True
+                break
+            gc.collect()
+    finally:
+        if glob['dac_gs'] and glob['dac_ds']:
+            # sustain output low if the batch is done or failed
+            glob['dac_gs'].write(0)
+            glob['dac_ds'].write(0)
+    logger.debug('batch complete: %s of %s jobs', len(results), len(jobs))
+    return {'jobs': results, 'break_bool': break_bool}
+
+async def dump_log(client, lines_per_message=20):
+    """
+    Publishes the in-RAM log ring on `<prefix>/debug/<board_id>/log`, oldest record first.
+    Is triggered by a message on `<prefix>/debug/<board_id>/dump` and after every error in main_callback().
+    """
+    log_topic = f"{glob['topic_prefix']}/debug/{glob["board_id"]}/log"
+    lines = []
+    for line in logger.dump():
+        lines.append(line)
+        if len(lines) == lines_per_message:
+            await client.publish(log_topic, '\n'.join(lines).encode('utf-8'))
+            lines = []
+    if lines:
+        await client.publish(log_topic, '\n'.join(lines).encode('utf-8'))
+
 async def main_callback(topic, msg, retained, qos, dup):
     global glob
     client = glob['main_client']
     topic = topic.decode('utf-8')
     topic_list = topic.split('/')
     msg = msg.decode('utf-8')
-    logger.debug(f'recieved mqtt message at {topic}, Payload: {msg}')
+    logger.debug('recieved mqtt message at %s, Payload: %s', topic, msg)
 
     condition_topic = f"{glob['topic_prefix']}/Zustand_Messplatz/{glob["board_id"]}"
     
@@ -554,7 +1162,17 @@ async def main_callback(topic, msg, retained, qos, dup):
         if len(topic_list) == 5 and topic_list[1] == glob['board_id']:
             payload = 'busy'.encode('utf-8')
             await client.publish(condition_topic, payload)
-            logger.debug(f'Publish at {condition_topic}, Payload: {payload}')
+            logger.debug('Publish at %s, Payload: %s', condition_topic, payload)
+            if glob['stream_task'] is not None:
+                # a time series is still running and holds the DACs, the board stays busy.
+                # The refusal is the result of the job, so clients do not wait for it.
+                refusal = 'time series running, send a Stop first'
+                debug_topic = f"{glob['topic_prefix']}/debug/{glob["board_id"]}"
+                await client.publish(debug_topic, refusal.encode('utf-8'))
+                logger.debug('Publish at %s, Payload: %s', debug_topic, refusal)
+                data_path = f"{topic_list[2]}/{topic_list[3]}/{glob["board_id"]}/{topic_list[4]}"
+                await publish_or_spool(client, data_path, refusal)
+                return
 
             msg = json.loads(msg)
             topic_dict = {
@@ -562,35 +1180,68 @@ async def main_callback(topic, msg, retained, qos, dup):
                 'time_stamp': topic_list[3],
                 'meas_type': topic_list[4]
             }
-            # checks whether hardware is available or whether emulation is required
-            if glob['dac_gs'] and glob['dac_ds']:
-                result = await meas(topic_dict, msg, client)
+            if topic_dict['meas_type'] == 'Time-Series':
+                # runs in the background, publishes its result and 'ready' when it is done
+                glob['stream_task'] = asyncio.create_task(time_series(topic_dict, msg, client))
+                return
+            if topic_dict['meas_type'] == 'Batch':
+                result = await run_batch(topic_dict, msg, client)
             else:
-                result = emu(topic_dict, msg)
-            
-            if result != 'unknown measurement type':
-                result = json.dumps(result)
+                result = await run_meas(topic_dict, msg, client)
             
-            data_topic = f"{glob['topic_prefix']}/Paket/{topic_list[2]}/{topic_list[3]}/{glob["board_id"]}/{topic_list[4]}"
-            payload = result.encode('utf-8')
-            await client.publish(data_topic, payload)
-            logger.debug(f'Publish at {data_topic}, Payload: {payload}')
+            data_path = f"{topic_list[2]}/{topic_list[3]}/{glob["board_id"]}/{topic_list[4]}"
+            await publish_or_spool(client, data_path, result)
             
             payload = 'ready'.encode('utf-8')
             await client.publish(condition_topic, payload)
-            logger.debug(f'Publish at {condition_topic}, Payload: {payload}')
+            logger.debug('Publish at %s, Payload: %s', condition_topic, payload)
         
         elif topic == f"{glob['topic_prefix']}/Status":
             status_topic = f"{topic}/Messplatz_{glob["board_id"]}"
             payload = 'online status confirmed'.encode('utf-8')
             await client.publish(status_topic, payload)
-            logger.debug(f'Publish at {status_topic}, Payload: {payload}')
+            logger.debug('Publish at %s, Payload: %s', status_topic, payload)
 
         elif topic == f"{glob['topic_prefix']}/Zustand_Messplatz":
-            payload = 'ready'.encode('utf-8')
+            # a running time series holds the DACs
+            payload = ('busy' if glob['stream_task'] is not None else 'ready').encode('utf-8')
             await client.publish(condition_topic, payload)
-            logger.debug(f'Publish at {condition_topic}, Payload: {payload}')
+            logger.debug('Publish at %s, Payload: %s', condition_topic, payload)
         
+        elif topic == f"{glob['topic_prefix']}/Kalibrierung/{glob["board_id"]}":
+            if not (glob['dac_gs'] and glob['dac_ds']) or glob['stream_task'] is not None:
+                raise RuntimeError('calibration needs idle hardware')
+            payload = 'busy'.encode('utf-8')
+            await client.publish(condition_topic, payload)
+            logger.debug('Publish at %s, Payload: %s', condition_topic, payload)
+            # no DUT current flows: one DAC is always at 0 V during the sweep
+            glob['cal'] = calib.calibrate(glob['dac_ds'], glob['dac_gs'], ADC(Pin(26)), ADC(Pin(27)), ADC(Pin(28)), old=glob['cal'])
+            glob['cal'].save(config['cal_file'])
+            logger.warning('calibration updated')
+            debug_topic = f"{glob['topic_prefix']}/debug/{glob["board_id"]}"
+            payload = json.dumps(glob['cal'].table).encode('utf-8')
+            await client.publish(debug_topic, payload)
+            logger.debug('Publish at %s, Payload: %s', debug_topic, payload)
+            payload = 'ready'.encode('utf-8')
+            await client.publish(condition_topic, payload)
+            logger.debug('Publish at %s, Payload: %s', condition_topic, payload)
+
+        elif topic == f"{glob['topic_prefix']}/debug/{glob["board_id"]}/dump":
+            await dump_log(client)
+
+        elif topic == f"{glob['topic_prefix']}/Stop/{glob["board_id"]}":
+            glob['stream_stop'] = True
+
+        elif topic == f"{glob['topic_prefix']}/Paket_Resend/{glob["board_id"]}":
+            msg = json.loads(msg)
+            transfer = glob['last_transfer']
+            if transfer is None or transfer['id'] != msg['id']:
+                raise ValueError(f"transfer {msg['id']} is no longer available")
+            if msg.get('chunks'):
+                await publish_chunks(client, transfer, msg['chunks'])
+            else: # e.g. the manifest got lost
+                await publish_manifest(client, transfer)
+
         elif topic == f"{glob['topic_prefix']}/update":
             try: # First case: Message contains a dictionary with filename and foldername that needs to be updated
                 msg = json.loads(msg)
@@ -601,33 +1252,36 @@ async def main_callback(topic, msg, retained, qos, dup):
             if type(msg) == dict and len(msg) == 2:
                 payload = f'updating {msg['file']}'.encode('utf-8')
                 await client.publish(update_topic, payload)
-                logger.debug(f'Publish at {update_topic}, Payload: {payload}')
+                logger.debug('Publish at %s, Payload: %s', update_topic, payload)
 
                 await updater(msg['file'], msg['folder'])
-                logger.warning(f'file {msg['file']} updated')
+                logger.warning('file %s updated', msg['file'])
 
             elif type(msg) == str:
                 payload = f'updating {msg}'.encode('utf-8')
                 await client.publish(update_topic, payload)
-                logger.debug(f'Publish at {update_topic}, Payload: {payload}')
+                logger.debug('Publish at %s, Payload: %s', update_topic, payload)
 
                 await updater(msg)
-                logger.warning(f'file {msg} updated')
+                logger.warning('file %s updated', msg)
             else:
                 return # do nothing
             
+            import machine
             machine.reset()
 
     except Exception as e:
         debug_topic = f"{glob['topic_prefix']}/debug/{glob["board_id"]}"
         payload = f'An Error occured: {e}'.encode('utf-8')
         await client.publish(debug_topic, payload)
-        logger.debug(f'Publish at {debug_topic}, Payload: {payload}')
+        logger.debug('Publish at %s, Payload: %s', debug_topic, payload)
 
         payload = 'ready'.encode('utf-8')
         await client.publish(condition_topic, payload)
-        logger.debug(f'Publish at {condition_topic}, Payload: {payload}')
-        logger.error(f'Error detected: {e}')
+        logger.debug('Publish at %s, Payload: %s', condition_topic, payload)
+        logger.error('Error detected: %s', e)
+        # the DEBUG history up to the error, without a serial cable
+        await dump_log(client)
 
     gc.collect()
 
@@ -636,12 +1290,23 @@ async def main_conn_callback(client):
     SUB_TOPIC_CONDITION = f"{glob['topic_prefix']}/Zustand_Messplatz"
     SUB_TOPIC_STATUS    = f"{glob['topic_prefix']}/Status"
     SUB_TOPIC_UPDATE    = f"{glob['topic_prefix'] }/update"
+    SUB_TOPIC_RESEND    = f"{glob['topic_prefix']}/Paket_Resend/{glob['board_id']}"
+    SUB_TOPIC_STOP      = f"{glob['topic_prefix']}/Stop/{glob['board_id']}"
+    SUB_TOPIC_CALIB     = f"{glob['topic_prefix']}/Kalibrierung/{glob['board_id']}"
+    SUB_TOPIC_DUMP      = f"{glob['topic_prefix']}/debug/{glob['board_id']}/dump"
 
     await client.subscribe(SUB_TOPIC_MEAS, 1)
     await client.subscribe(SUB_TOPIC_STATUS, 1)
     await client.subscribe(SUB_TOPIC_UPDATE, 1)
     await client.subscribe(SUB_TOPIC_CONDITION, 1)
+    await client.subscribe(SUB_TOPIC_RESEND, 1)
+    await client.subscribe(SUB_TOPIC_STOP, 1)
+    await client.subscribe(SUB_TOPIC_CALIB, 1)
+    await client.subscribe(SUB_TOPIC_DUMP, 1)
     logger.debug('main subscription succesful')
+    # is called after every (re)connect: send the results that were spooled while offline
+    if glob['spool'].pending():
+        asyncio.create_task(replay_spool(client))
 
 async def main():
     global glob
@@ -664,19 +1329,31 @@ async def main():
     main_config['wifi_pw'] = 'must_be_any_string'
 
 
+    glob['spool'] = spool.ResultSpool(config['spool_file'], config['spool_max_size'])
     main_client = mqtt_async.MQTTClient(main_config)
     glob['main_config'] = main_config
     glob['main_client'] = main_client
     
     await init_hw()
+    boot.mark('hardware')
     await broker_conn_loop(main_client)
     logger.info('Connection to broker succesfully established')
+    boot.mark('broker')
 
     condition_topic = f"{glob['topic_prefix']}/Zustand_Messplatz/{glob["board_id"]}"
     payload = 'ready'.encode('utf-8')
     await main_client.publish(condition_topic, payload)
-    logger.debug(f'Publish at {condition_topic}, Payload: {payload}')
-    logger.debug(f'Free RAM: {gc.mem_free()/1000} kB')
+    logger.debug('Publish at %s, Payload: %s', condition_topic, payload)
+    logger.debug('Free RAM: %s kB', gc.mem_free()/1000)
+    boot.mark('ready')
+
+    # boot profile: time and free memory after every boot phase
+    boot_topic = f"{glob['topic_prefix']}/debug/{glob["board_id"]}/boot"
+    report = boot.report()
+    report['wifi'] = glob['wifi_stats']['last_path']
+    payload = json.dumps(report).encode('utf-8')
+    await main_client.publish(boot_topic, payload)
+    logger.info('boot to ready in %s ms', report['total_ms'])
 
     #connTask = asyncio.create_task(check_connection())
     blink_task = asyncio.create_task(blink(glob['led_board'], glob['board_id'], glob['btn_3']))
@@ -684,8 +1361,13 @@ async def main():
     await asyncio.gather(blink_task, mqttTask)
 
 async def mqtt_task():
+    global glob
     while True:
         await asyncio.sleep(0.5)
+        # release the last chunked result when nobody asked for a resend in time
+        transfer = glob['last_transfer']
+        if transfer is not None and time.ticks_diff(time.ticks_ms(), transfer['expires']) > 0:
+            glob['last_transfer'] = None
 
 # needs some further improvement... may no longer be needed
 async def check_connection():
@@ -707,6 +1389,7 @@ async def check_connection():
 
 # new function to remotely change currently running script. Command via mqtt
 async def updater(file_name, folder=None):
+    import urequests
     url = f'https://raw.githubusercontent.com/skaly03/skript_updater/main/{file_name}'
     r = urequests.get(url)
     if folder:
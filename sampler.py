@@ -0,0 +1,422 @@
+import array
+import asyncio
+import time
+import _thread
+
+try:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    # cpython: emulate the micropython tick counter (wraps at 2**30)
+    def ticks_us():
+        return (time.monotonic_ns() // 1000) & 0x3fffffff
+    def ticks_diff(a, b):
+        return ((a - b + 0x20000000) & 0x3fffffff) - 0x20000000
+
+# flags of the ring buffer entries
+POINT   = 0 # measured point
+ROW_END = 1 # end of a row (one U_GS value of a Combined-Sweep)
+BREAK   = 2 # over-current, the rest of the row was skipped
+DONE    = 3 # worker finished
+ERROR   = 4 # worker failed, the exception is in RingBuffer.error
+
+class RingBuffer:
+    """
+    Preallocated single producer / single consumer ring buffer.
+
+    No lock is needed: `head` is only written by the producer (sampling worker),
+    `tail` only by the consumer (asyncio side). One slot always stays empty to tell
+    a full buffer from an empty one.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.flag = array.array('B', [0] * size)
+        self.ds = array.array('f', [0.0] * size)
+        self.gs = array.array('f', [0.0] * size)
+        self.ib = array.array('f', [0.0] * size)
+        self.head = 0
+        self.tail = 0
+        self.stop = False # set by the consumer to stop the producer
+        self.running = False # a producer thread is using the buffer
+        self.error = None
+
+    def reset(self):
+        self.head = 0
+        self.tail = 0
+        self.stop = False
+        self.error = None
+
+    def __len__(self):
+        return (self.head - self.tail) % self.size
+
+    def put(self, flag, ds=0.0, gs=0.0, ib=0.0):
+        """
+        Returns False if the buffer is full.
+        """
+        head = self.head
+        nxt = (head + 1) % self.size
+        if nxt == self.tail:
+            return False
+        self.flag[head] = flag
+        self.ds[head] = ds
+        self.gs[head] = gs
+        self.ib[head] = ib
+        self.head = nxt # publish the entry only after it has been written
+        return True
+
+    def get(self):
+        """
+        Returns (flag, ds, gs, ib) or None if the buffer is empty.
+        """
+        tail = self.tail
+        if tail == self.head:
+            return None
+        entry = (self.flag[tail], self.ds[tail], self.gs[tail], self.ib[tail])
+        self.tail = (tail + 1) % self.size
+        return entry
+
+class FrameBuffer:
+    """
+    Fixed-size buffer of aggregated frames for continuous acquisition.
+
+    Every sample is folded into the open frame (running min, sum and max per channel),
+    a frame is closed after `window` samples. RAM only depends on the number of frames
+    `size`, not on the window. The producer is a timer callback which must not wait,
+    so the samples of a frame are dropped (and counted) if all frames are full.
+    """
+    def __init__(self, window, size=8):
+        self.window = window
+        self.size = size
+        self.ticks = array.array('I', [0] * size)
+        self.n = array.array('I', [0] * size)
+        # per channel (U_DS, U_GS, I_D)
+        self.lo = [array.array('f', [0.0] * size) for _ in range(3)]
+        self.sum = [array.array('f', [0.0] * size) for _ in range(3)]
+        self.hi = [array.array('f', [0.0] * size) for _ in range(3)]
+        self.head = 0 # open frame, only written by the producer
+        self.tail = 0 # oldest closed frame, only written by the consumer
+        self.dropped = 0
+
+    def reset(self):
+        self.head = 0
+        self.tail = 0
+        self.n[0] = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return (self.head - self.tail) % self.size
+
+    def add(self, ticks, ds, gs, ib):
+        h = self.head
+        n = self.n[h]
+        if n == 0:
+            self.ticks[h] = ticks
+        for ch, value in ((0, ds), (1, gs), (2, ib)):
+            if n == 0:
+                self.lo[ch][h] = value
+                self.sum[ch][h] = value
+                self.hi[ch][h] = value
+            else:
+                self.sum[ch][h] += value
+                if value < self.lo[ch][h]:
+                    self.lo[ch][h] = value
+                elif value > self.hi[ch][h]:
+                    self.hi[ch][h] = value
+        self.n[h] = n + 1
+        if n + 1 >= self.window:
+            self.close()
+
+    def close(self):
+        """
+        Closes the open frame, if it has samples.
+        """
+        h = self.head
+        if self.n[h] == 0:
+            return
+        nxt = (h + 1) % self.size
+        if nxt == self.tail:
+            self.dropped += self.n[h]
+            self.n[h] = 0
+            return
+        self.n[nxt] = 0
+        self.head = nxt
+
+    def get(self):
+        """
+        Returns the oldest closed frame with [min, mean, max] per channel, the number of
+        samples `n` and the ticks_us of the first sample `t`, or None.
+        """
+        t = self.tail
+        if t == self.head:
+            return None
+        n = self.n[t]
+        frame = {'n': n, 't': self.ticks[t]}
+        for ch, key in ((0, 'U_DS'), (1, 'U_GS'), (2, 'I_D')):
+            frame[key] = [self.lo[ch][t], self.sum[ch][t] / n, self.hi[ch][t]]
+        self.tail = (t + 1) % self.size
+        return frame
+
+class TimerSampler:
+    """
+    ### Timer-driven sampling
+
+    Samples the three ADC channels with a fixed rate (Hz) into a FrameBuffer.
+    Uses machine.Timer on micropython and a thread on cpython. If I_D exceeds `i_max`
+    sampling stops and the DACs are set to 0 V right away.
+    """
+    def __init__(self, frames, backend, rate, i_max=0.1):
+        self.frames = frames
+        self.backend = backend
+        self.rate = rate
+        self.i_max = i_max
+        self.over_current = False
+        self.timer = None
+        self.running = False
+
+    def _sample(self, timer=None):
+        if self.over_current:
+            return
+        ds, gs, ib = self.backend.read()
+        self.frames.add(ticks_us(), ds, gs, ib)
+        if ib > self.i_max:
+            self.over_current = True
+            self.stop()
+            self.backend.zero()
+
+    def _thread_loop(self):
+        period = 1 / self.rate
+        while self.running:
+            self._sample()
+            time.sleep(period)
+
+    def start(self):
+        self.frames.reset()
+        self.over_current = False
+        self.running = True
+        try:
+            from machine import Timer
+        except ImportError:
+            _thread.start_new_thread(self._thread_loop, ())
+            return
+        self.timer = Timer(mode=Timer.PERIODIC, freq=self.rate, callback=self._sample)
+
+    def stop(self):
+        self.running = False
+        if self.timer is not None:
+            self.timer.deinit()
+            self.timer = None
+
+class HwBackend:
+    """
+    Drives the MCP4725 DACs and reads the three ADC channels,
+    converted with the board calibration (calib.Calibration).
+    """
+    def __init__(self, dac_ds, dac_gs, adc_ds, adc_gs, adc_Ib, cal):
+        self.dac_ds = dac_ds
+        self.dac_gs = dac_gs
+        self.adc_ds = adc_ds
+        self.adc_gs = adc_gs
+        self.adc_Ib = adc_Ib
+        self.cal = cal
+
+    def set_gs(self, value):
+        self.dac_gs.write(self.cal.dac_code('gs', value))
+
+    def set_ds(self, value):
+        self.dac_ds.write(self.cal.dac_code('ds', value))
+
+    def read(self):
+        """
+        Returns one sample (U_DS, U_GS, I_D)
+        """
+        cal = self.cal
+        ds = cal.convert('ds', self.adc_ds.read_u16())
+        gs = cal.convert('gs', self.adc_gs.read_u16())
+        ib = cal.convert('ib', self.adc_Ib.read_u16())
+        return ds, gs, ib
+
+    def read_avg(self, multi, i_max=0.1):
+        """
+        Averages `multi` samples (U_DS, U_GS, I_D). The raw readings are summed as integers
+        and converted once. Returns None if any sample exceeds `i_max`.
+        """
+        ib_limit = self.cal.raw_limit('ib', i_max)
+        adc_ds, adc_gs, adc_Ib = self.adc_ds, self.adc_gs, self.adc_Ib
+        ds_sum, gs_sum, ib_sum = 0, 0, 0
+        for _ in range(multi):
+            ds_sum += adc_ds.read_u16()
+            gs_sum += adc_gs.read_u16()
+            ib_raw = adc_Ib.read_u16()
+            ib_sum += ib_raw
+            if ib_raw > ib_limit:
+                return None
+        cal = self.cal
+        return cal.convert('ds', ds_sum / multi), cal.convert('gs', gs_sum / multi), cal.convert('ib', ib_sum / multi)
+
+    def zero(self):
+        self.dac_gs.write(0)
+        self.dac_ds.write(0)
+
+class SimBackend:
+    """
+    Simulated hardware based on hw_emu.calc_current(), e.g. for testing on Linux.
+    """
+    def __init__(self):
+        from hw_emu import calc_current
+        self.calc_current = calc_current
+        self.u_gs = 0.0
+        self.u_ds = 0.0
+
+    def set_gs(self, value):
+        self.u_gs = value
+
+    def set_ds(self, value):
+        self.u_ds = value
+
+    def read(self):
+        return self.u_ds, self.u_gs, self.calc_current(self.u_gs, self.u_ds)
+
+    def read_avg(self, multi, i_max=0.1):
+        ds, gs, ib = self.read() # noise free, all samples are equal
+        if ib > i_max:
+            return None
+        return ds, gs, ib
+
+    def zero(self):
+        self.u_gs = 0.0
+        self.u_ds = 0.0
+
+def rows(meas_type, value_dict):
+    """
+    Generator of the rows of a measurement. Every row is a list of (U_GS, U_DS) setpoints.
+    The sweep types have one row, the Combined-Sweep one row per U_GS value.
+    Takes the same value_dict as meas().
+    """
+    if meas_type == 'Drain-Source-Sweep':
+        gs_value = value_dict['U_GS']
+        yield [(gs_value, ds_value) for ds_value in value_dict['U_DS']]
+    elif meas_type == 'Gate-Source-Sweep':
+        ds_value = value_dict['U_DS']
+        yield [(gs_value, ds_value) for gs_value in value_dict['U_GS']]
+    elif meas_type == 'Combined-Sweep':
+        for gs_value in value_dict['U_GS']:
+            yield [(gs_value, ds_value) for ds_value in value_dict['U_DS']]
+    else:
+        raise ValueError('unknown measurement type')
+
+def _push(ring, flag, ds=0.0, gs=0.0, ib=0.0):
+    # the producer waits for the consumer instead of dropping points
+    while not ring.put(flag, ds, gs, ib):
+        if ring.stop:
+            return
+        time.sleep(0.001)
+
+def sample_worker(ring, backend, setpoints, multi=1, settle=0.1, zero=True):
+    """
+    ### Sampling worker
+
+    Drives the DACs, oversamples the ADCs `multi` times per point and writes the averaged
+    points into `ring`. Is meant to run on the second core via start().
+        Args:
+            * ring (RingBuffer)
+            * backend (HwBackend or SimBackend)
+            * setpoints (iterable of rows, see rows())
+            * multi (int): number of samples per point
+            * settle (float): time in s to wait after setting the DACs
+            * zero (bool): set the DACs to 0 V when done
+    """
+    try:
+        for row in setpoints:
+            last_gs = None
+            for gs_value, ds_value in row:
+                if ring.stop:
+                    return
+                if gs_value != last_gs:
+                    backend.set_gs(gs_value)
+                    last_gs = gs_value
+                backend.set_ds(ds_value)
+                time.sleep(settle) # Wait a little...
+                point = backend.read_avg(multi, 0.1)
+                if point is None: # any Ib_current > 0.1 A
+                    _push(ring, BREAK)
+                    break
+                _push(ring, POINT, *point)
+            _push(ring, ROW_END)
+    except Exception as e:
+        # e.g. an I2C error: collect() raises it instead of returning a truncated result
+        ring.error = e
+        _push(ring, ERROR)
+    finally:
+        try:
+            if zero:
+                backend.zero()
+        except Exception as e:
+            if ring.error is None:
+                ring.error = e
+                _push(ring, ERROR)
+        _push(ring, DONE)
+        ring.running = False
+
+async def start(ring, backend, setpoints, multi=1, settle=0.1, zero=True, timeout=2):
+    """
+    Starts sample_worker() on the second core (micropython) or in a thread (cpython).
+    Waits up to `timeout` seconds for a previous worker on the same ring to exit,
+    the second core can only run one thread. The event loop keeps running meanwhile.
+    """
+    ring.stop = True
+    waited = 0
+    while ring.running:
+        if waited >= timeout:
+            raise RuntimeError('previous sampling worker did not stop')
+        await asyncio.sleep(0.01)
+        waited += 0.01
+    ring.reset()
+    ring.running = True
+    try:
+        _thread.start_new_thread(sample_worker, (ring, backend, setpoints, multi, settle, zero))
+    except Exception:
+        ring.running = False
+        raise
+
+async def collect(ring, on_point=None, poll=0.005):
+    """
+    ### Drains the ring buffer on the asyncio side
+
+    Waits for points from sample_worker() and collects them row by row.
+    `on_point(row, ds, gs, ib)` is awaited for every point, e.g. to publish it.
+        Returns:
+            (ds_rows, gs_rows, ib_rows, break_bool): lists of rows
+        Raises:
+            the exception of the worker, if it failed
+    """
+    ds_rows, gs_rows, ib_rows = [], [], []
+    ds_row, gs_row, ib_row = [], [], []
+    break_bool = False
+    try:
+        while True:
+            entry = ring.get()
+            if entry is None:
+                await asyncio.sleep(poll)
+                continue
+            flag, ds, gs, ib = entry
+            if flag == POINT:
+                ds_row.append(ds)
+                gs_row.append(gs)
+                ib_row.append(ib)
+                if on_point is not None:
+                    await on_point(len(ds_rows), ds, gs, ib)
+            elif flag == BREAK:
+                break_bool = True
+            elif flag == ROW_END:
+                ds_rows.append(ds_row)
+                gs_rows.append(gs_row)
+                ib_rows.append(ib_row)
+                ds_row, gs_row, ib_row = [], [], []
+            elif flag == ERROR:
+                raise RuntimeError(f'sampling worker failed: {ring.error}')
+            elif flag == DONE:
+                break
+    finally:
+        # stops the worker if the consumer fails, e.g. because of a broken connection
+        ring.stop = True
+    return ds_rows, gs_rows, ib_rows, break_bool
@@ -0,0 +1,62 @@
+def select_rows(n_rows, spec):
+    """
+    Row indices of a Combined-Sweep (one row per U_GS value) that belong to a shard.
+        Args:
+            * n_rows (int): number of U_GS values of the whole sweep
+            * spec (dict): {'index': i, 'count': n} takes every n-th row starting at i,
+              {'rows': [start, stop]} takes the rows start <= row < stop
+        Returns:
+            list of int
+    """
+    if 'rows' in spec:
+        start, stop = spec['rows']
+        return list(range(max(0, start), min(n_rows, stop)))
+    return list(range(spec['index'], n_rows, spec['count']))
+
+def split(count, n_rows=None):
+    """
+    Shard specs for up to `count` boards. With `n_rows` the sweep is split into contiguous
+    row ranges, otherwise by stride (works without knowing the number of rows).
+    With `n_rows` there are never more shards than rows and no shard is empty.
+    """
+    if n_rows is None:
+        return [{'index': idx, 'count': count} for idx in range(count)]
+    count = min(count, n_rows)
+    if count <= 0:
+        return []
+    size = (n_rows + count - 1) // count
+    specs = []
+    for idx in range(count):
+        start = min(n_rows, idx * size)
+        stop = min(n_rows, (idx + 1) * size)
+        if start < stop:
+            specs.append({'rows': [start, stop]})
+    return specs
+
+def merge(results):
+    """
+    Merges the Combined-Sweep results of several shards into one result.
+    Every result needs the metadata `shard` with the `row_index` of its rows and exactly
+    one (possibly empty) row per row index. Raises a ValueError otherwise.
+        Returns:
+            {'U_DS': [...], 'U_GS': [...], 'I_D': [...], 'break_bool': bool, 'row_index': [...]}
+    """
+    rows = {}
+    break_bool = False
+    for result in results:
+        break_bool = break_bool or result['break_bool']
+        row_index = result['shard']['row_index']
+        for key in ('U_DS', 'U_GS', 'I_D'):
+            if len(result[key]) != len(row_index):
+                raise ValueError('shard %s: %d rows in %s, but %d row indices'
+                                 % (result['shard'], len(result[key]), key, len(row_index)))
+        for pos, row in enumerate(row_index):
+            rows[row] = (result['U_DS'][pos], result['U_GS'][pos], result['I_D'][pos])
+    order = sorted(rows)
+    return {
+        'U_DS': [rows[row][0] for row in order],
+        'U_GS': [rows[row][1] for row in order],
+        'I_D': [rows[row][2] for row in order],
+        'break_bool': break_bool,
+        'row_index': order,
+    }
@@ -0,0 +1,198 @@
+import struct
+import os
+
+class ResultSpool:
+    """
+    Flash-backed spool for results that could not be published.
+
+    Every record is stored as header (path length, payload length), path and payload.
+    The file is limited to `max_size` bytes, the oldest records are evicted first.
+    `removed` counts the records removed from the start so far; a reader which awaits
+    between read_batch() and drop_records() uses it to find out how many of its records
+    were evicted in the meantime.
+
+    A reset while writing can leave an incomplete record at the end, it is cut off at
+    start-up and before the next append, so later results stay readable.
+    """
+    HEADER = '<HI'
+    HEADER_SIZE = struct.calcsize(HEADER)
+    BLOCK = 512 # bytes copied at once when the file is compacted
+
+    def __init__(self, filename="spool.bin", max_size=64*1024):
+        self.filename = filename
+        self.max_size = max_size
+        self.removed = 0
+        self._recover()
+        self.end = self._complete_end() # end of the last complete record
+        if self.end < self.size():
+            self._cut(self.end)
+
+    def size(self):
+        try:
+            return os.stat(self.filename)[6]
+        except OSError:
+            return 0
+
+    def pending(self):
+        return self.size() > 0
+
+    def _recover(self):
+        # a reset in _replace() leaves the .tmp file: complete if the spool is gone
+        tmp = self.filename + ".tmp"
+        try:
+            os.stat(tmp)
+        except OSError:
+            return
+        try:
+            if self.size() == 0:
+                os.rename(tmp, self.filename)
+            else:
+                os.remove(tmp)
+        except OSError as e:
+            print("Spool: Fehler beim Wiederherstellen:", e)
+
+    def _complete_end(self):
+        # offset after the last complete record
+        end = 0
+        size = self.size()
+        try:
+            with open(self.filename, 'rb') as file:
+                for offset in self._record_ends(file):
+                    if offset > size:
+                        break
+                    end = offset
+        except OSError:
+            pass
+        return end
+
+    def append(self, path, payload):
+        """
+        Appends one result. Evicts the oldest results if the spool gets too big.
+        """
+        if self.size() != self.end: # incomplete record from a failed write
+            self._cut(self._complete_end())
+        path = path.encode('utf-8')
+        with open(self.filename, 'ab') as file:
+            file.write(struct.pack(self.HEADER, len(path), len(payload)))
+            file.write(path)
+            file.write(payload)
+        self.end += self.HEADER_SIZE + len(path) + len(payload)
+        size = self.size()
+        if size > self.max_size:
+            self._evict(size - self.max_size)
+
+    def _record_ends(self, file):
+        # yields the offset after every record
+        offset = 0
+        while True:
+            header = file.read(self.HEADER_SIZE)
+            if len(header) < self.HEADER_SIZE:
+                return
+            path_len, payload_len = struct.unpack(self.HEADER, header)
+            offset += self.HEADER_SIZE + path_len + payload_len
+            file.seek(offset)
+            yield offset
+
+    def _evict(self, nbytes):
+        # drops whole records from the start until at least nbytes are free,
+        # the newest record is always kept
+        offset = 0
+        last_start = 0
+        count = 0
+        with open(self.filename, 'rb') as file:
+            for end in self._record_ends(file):
+                if offset >= nbytes:
+                    break
+                last_start = offset
+                offset = end
+                count += 1
+        if offset >= self.size():
+            offset = last_start
+            count -= 1
+        if offset == 0:
+            return
+        print("Spool: %d bytes alter Ergebnisse verworfen" % offset)
+        self.drop(offset)
+        self.removed += count
+
+    def read_batch(self, count):
+        """
+        Reads up to `count` results from the start of the spool.
+            Returns:
+                (list of (path, payload), offset): pass offset to drop() once the batch is sent
+        """
+        batch = []
+        offset = 0
+        try:
+            with open(self.filename, 'rb') as file:
+                while len(batch) < count:
+                    header = file.read(self.HEADER_SIZE)
+                    if len(header) < self.HEADER_SIZE:
+                        break
+                    path_len, payload_len = struct.unpack(self.HEADER, header)
+                    path = file.read(path_len).decode('utf-8')
+                    payload = file.read(payload_len)
+                    if len(payload) < payload_len: # incomplete record, e.g. after a reset
+                        break
+                    batch.append((path, payload))
+                    offset += self.HEADER_SIZE + path_len + payload_len
+        except OSError:
+            pass
+        return batch, offset
+
+    def drop_records(self, count):
+        """
+        Removes the first `count` records. The offset is computed from the current file,
+        so records appended or evicted since read_batch() are handled correctly.
+        """
+        if count <= 0:
+            return
+        offset = 0
+        n = 0
+        try:
+            with open(self.filename, 'rb') as file:
+                for offset in self._record_ends(file):
+                    n += 1
+                    if n == count:
+                        break
+        except OSError:
+            return
+        if n:
+            self.drop(offset)
+            self.removed += n
+
+    def drop(self, offset):
+        """
+        Removes the first `offset` bytes of the spool.
+        """
+        self._replace(offset, None)
+        self.end = max(0, self.end - offset)
+
+    def _cut(self, end):
+        # removes everything after `end`, e.g. an incomplete record
+        print("Spool: unvollständigen Eintrag verworfen")
+        self._replace(0, end)
+        self.end = self.size()
+
+    def _replace(self, start, end):
+        # replaces the spool with the bytes start..end (None: up to the end of the file)
+        tmp = self.filename + ".tmp"
+        try:
+            with open(self.filename, 'rb') as src, open(tmp, 'wb') as dst:
+                src.seek(start)
+                left = None if end is None else end - start
+                while left is None or left > 0:
+                    block = src.read(self.BLOCK if left is None else min(self.BLOCK, left))
+                    if not block:
+                        break
+                    dst.write(block)
+                    if left is not None:
+                        left -= len(block)
+            try:
+                os.rename(tmp, self.filename) # replaces the file on littlefs
+            except OSError:
+                # e.g. FAT: a reset in between is completed by _recover()
+                os.remove(self.filename)
+                os.rename(tmp, self.filename)
+        except Exception as e:
+            print("Spool: Fehler beim Kürzen der Datei:", e)
@@ -1,8 +1,29 @@
 import network
 import ntptime
 import machine
+import asyncio
+import socket
+import struct
+import json
 import time
 
+# last known clock offset and drift, restored at boot before ntp is reachable
+CACHE_FILE = 'time_cache.json'
+# seconds between 1900-01-01 (ntp) and the epoch of time.time()
+NTP_DELTA = 2208988800 if time.gmtime(0)[0] == 1970 else 3155673600
+# mapping ticks_us -> wall clock: `secs` + `us` microseconds at `ticks`, the clock runs
+# `drift` ppm fast. Only integers: the floats of the rp2 port have 24 bit, that is a
+# resolution of 128 s for the seconds since 1970.
+clock = {
+    'secs': None,
+    'us': 0,
+    'ticks': 0,
+    'drift': 0,
+    'synced': None, # seconds of the last successful ntp sync
+}
+# limit of the drift estimate in ppm
+MAX_DRIFT = 1000
+
 def ntp_sync():
     """
     micropython protocol to sync the rtc with the current localtime
@@ -28,5 +49,149 @@ def ntp_sync():
     rtc = machine.RTC()
     print("RTC Zeit:", rtc.datetime())
 
+def _add_us(secs, us, dt):
+    # (secs, us) + dt microseconds, normalised to 0 <= us < 1000000
+    us += dt
+    return secs + us // 1000000, us % 1000000
+
+def ticks_to_wall(ticks):
+    """
+    Converts a `time.ticks_us()` value into the wall clock (epoch of time.time()).
+    Returns (seconds, microseconds) as integers, or None if the clock was never set.
+    The ticks must not be older than about 8 minutes, sync_task() keeps the mapping fresh.
+    """
+    if clock['secs'] is None:
+        return None
+    dt = time.ticks_diff(ticks, clock['ticks'])
+    # drift correction in two steps, so every product stays a small int
+    dt += (dt // 1000) * clock['drift'] // 1000
+    return _add_us(clock['secs'], clock['us'], dt)
+
+def ticks_to_ms(ticks):
+    """
+    Wall clock of a `time.ticks_us()` value in integer milliseconds since the epoch,
+    e.g. for json. None if the clock was never set.
+    """
+    wall = ticks_to_wall(ticks)
+    if wall is None:
+        return None
+    return wall[0] * 1000 + wall[1] // 1000
+
+def _rebase():
+    # move the reference point to now, ticks_us wraps after ~18 minutes
+    now = time.ticks_us()
+    clock['secs'], clock['us'] = ticks_to_wall(now)
+    clock['ticks'] = now
+
+def _set_rtc(secs):
+    # whole seconds only, the rtc has no sub-second field that could be set
+    tm = time.gmtime(secs)
+    machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+
+def save():
+    try:
+        with open(CACHE_FILE, 'w') as file:
+            secs, us = ticks_to_wall(time.ticks_us())
+            json.dump({'secs': secs, 'drift_ppm': clock['drift']}, file)
+    except Exception as e:
+        print("Zeit-Cache konnte nicht gespeichert werden:", e)
+
+def restore():
+    """
+    Starts the clock with the cached values from the last sync, so timestamps are
+    approximately right before ntp is reachable. Returns True if a cache was found.
+    """
+    try:
+        with open(CACHE_FILE) as file:
+            cache = json.load(file)
+    except Exception:
+        return False
+    if 'secs' not in cache:
+        return False
+    clock['drift'] = max(-MAX_DRIFT, min(MAX_DRIFT, int(cache.get('drift_ppm', 0))))
+    if time.localtime()[0] < 2024: # rtc not set since power up
+        _set_rtc(int(cache['secs']))
+    clock['secs'] = int(time.time())
+    clock['us'] = 0
+    clock['ticks'] = time.ticks_us()
+    print("Zeit aus Cache geladen:", time.localtime())
+    return True
+
+async def ntp_time(host=None, timeout=2):
+    """
+    Non-blocking ntp query. Returns (ticks_us, seconds, microseconds) of the wall clock at
+    the time of the answer, all integers. Raises an OSError if there is no answer within `timeout` seconds.
+    """
+    addr = socket.getaddrinfo(host or ntptime.host, 123)[0][-1]
+    query = bytearray(48)
+    query[0] = 0x1B
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        start = time.ticks_us()
+        sock.sendto(query, addr)
+        while True:
+            try:
+                msg = sock.recv(48)
+                break
+            except OSError:
+                if time.ticks_diff(time.ticks_us(), start) > timeout * 1000000:
+                    raise OSError('ntp timeout')
+                await asyncio.sleep(0.02)
+    finally:
+        sock.close()
+    now = time.ticks_us()
+    secs, frac = struct.unpack('!II', msg[40:48])
+    # the answer was sent about half of the round trip time ago
+    delay = time.ticks_diff(now, start) // 2
+    secs, us = _add_us(secs - NTP_DELTA, (frac * 1000000) >> 32, delay)
+    return now, secs, us
+
+async def sync(timeout=2):
+    """
+    Syncs rtc and clock mapping with ntp and updates the drift estimate.
+    """
+    start = time.ticks_ms()
+    ticks, secs, us = await ntp_time(timeout=timeout)
+    if clock['synced'] is not None:
+        predicted_secs, predicted_us = ticks_to_wall(ticks)
+        elapsed = predicted_secs - clock['synced']
+        if elapsed > 60:
+            # rate error of the local oscillator in ppm (us per s), smoothed and limited
+            error = (secs - predicted_secs) * 1000000 + us - predicted_us
+            drift = clock['drift'] + error // elapsed
+            drift = max(-MAX_DRIFT, min(MAX_DRIFT, drift))
+            clock['drift'] = (clock['drift'] + drift) // 2
+    clock['secs'] = secs
+    clock['us'] = us
+    clock['ticks'] = ticks
+    clock['synced'] = secs
+    _set_rtc(secs)
+    save()
+    print("Zeit synchronisiert in %d ms:" % time.ticks_diff(time.ticks_ms(), start), time.localtime())
+
+async def sync_task(interval=3600, timeout=2, rebase=60):
+    """
+    Background task: syncs with ntp every `interval` seconds (every `rebase` seconds
+    until the first sync succeeded) and keeps the ticks mapping fresh in between.
+    Never blocks the event loop for longer than a dns lookup.
+    """
+    if clock['secs'] is None:
+        clock['secs'] = int(time.time())
+        clock['us'] = 0
+        clock['ticks'] = time.ticks_us()
+    next_sync = 0
+    while True:
+        if next_sync <= 0:
+            try:
+                await sync(timeout)
+                next_sync = interval
+            except Exception as e:
+                print("NTP-Sync fehlgeschlagen:", e)
+                next_sync = rebase
+        await asyncio.sleep(rebase)
+        next_sync -= rebase
+        _rebase()
+
 if __name__ == '__main__':
     ntp_sync()
@@ -1,5 +1,175 @@
 import time
 import os
+import struct
+
+# type codes of the args in a LogRing slot
+_NONE, _BOOL, _INT, _FLOAT, _STR, _BYTES, _TYPE = range(7)
+
+def _decode(data):
+    # a truncated str may end inside a multi-byte character
+    for cut in range(4):
+        try:
+            return data[:len(data) - cut].decode('utf-8')
+        except UnicodeError:
+            pass
+    return repr(data)
+
+class LogRing:
+    """
+    Fixed-size ring buffer of the most recent log records in RAM.
+
+    Every record is a fixed-width slot of `slot` bytes in one preallocated bytearray:
+    level, ticks_ms, template id and the args in binary form. Ints and floats are
+    packed, str/bytes are copied truncated to `max_arg` bytes (and to the room left in
+    the slot), exceptions are stored as text and of all other objects only the type
+    name is kept. No reference to an arg survives the call, so the RAM use is fixed.
+    Every message template gets an id on first use (up to `max_templates` templates of
+    at most `max_arg` characters, later templates are stored as their first arg).
+    Args that do not fit into the slot are dropped.
+    """
+    NO_TEMPLATE = 0xFFFF
+    HEADER = '<BIHB' # level, ticks_ms, template id, number of args
+    HEADER_SIZE = struct.calcsize(HEADER)
+
+    def __init__(self, size=256, max_templates=128, max_arg=64, slot=96):
+        self.size = size
+        self.max_templates = max_templates
+        self.max_arg = max_arg
+        self.slot = slot
+        self.buf = bytearray(size * slot)
+        self.view = memoryview(self.buf)
+        self.templates = []
+        self._ids = {}
+        self.idx = 0
+        self.count = 0
+
+    def _put(self, pos, end, arg):
+        # writes one arg at pos, returns the position after it or -1 if it does not fit
+        buf = self.buf
+        t = type(arg)
+        if arg is None:
+            if pos + 1 > end:
+                return -1
+            buf[pos] = _NONE
+            return pos + 1
+        if t is bool:
+            if pos + 2 > end:
+                return -1
+            buf[pos] = _BOOL
+            buf[pos + 1] = 1 if arg else 0
+            return pos + 2
+        if t is int and -0x80000000 <= arg <= 0x7FFFFFFF:
+            if pos + 5 > end:
+                return -1
+            buf[pos] = _INT
+            struct.pack_into('<i', buf, pos + 1, arg)
+            return pos + 5
+        if t is float:
+            if pos + 5 > end:
+                return -1
+            buf[pos] = _FLOAT
+            struct.pack_into('<f', buf, pos + 1, arg)
+            return pos + 5
+        n = min(self.max_arg, end - pos - 2)
+        if n < 0:
+            return -1
+        if t in (bytes, bytearray, memoryview):
+            kind = _BYTES
+            n = min(n, len(arg))
+            self.view[pos + 2:pos + 2 + n] = memoryview(arg)[:n]
+        else:
+            if t is str:
+                kind = _STR
+            elif isinstance(arg, BaseException):
+                kind = _STR
+                arg = '%s: %s' % (type(arg).__name__, arg)
+            else: # big int, list, dict, ...: the type name only
+                kind = _TYPE
+                arg = type(arg).__name__
+            if len(arg) > n:
+                arg = arg[:n]
+            data = arg.encode('utf-8')
+            n = min(n, len(data))
+            self.view[pos + 2:pos + 2 + n] = data[:n] if n < len(data) else data
+        buf[pos] = kind
+        buf[pos + 1] = n
+        return pos + 2 + n
+
+    def add(self, level, msg, args):
+        if len(msg) > self.max_arg:
+            msg = msg[:self.max_arg]
+        tid = self._ids.get(msg)
+        if tid is None and len(self.templates) < self.max_templates:
+            tid = len(self.templates)
+            self.templates.append(msg)
+            self._ids[msg] = tid
+        base = self.idx * self.slot
+        end = base + self.slot
+        pos = base + self.HEADER_SIZE
+        nargs = 0
+        if tid is None:
+            tid = self.NO_TEMPLATE
+            pos = self._put(pos, end, msg)
+            nargs = 1
+        for arg in args:
+            new_pos = self._put(pos, end, arg)
+            if new_pos < 0:
+                break
+            pos = new_pos
+            nargs += 1
+        struct.pack_into(self.HEADER, self.buf, base, level, time.ticks_ms() & 0xFFFFFFFF, tid, nargs)
+        self.idx = (self.idx + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def _args(self, pos, nargs):
+        # decodes the args of one slot
+        buf = self.buf
+        args = []
+        for _ in range(nargs):
+            kind = buf[pos]
+            if kind == _NONE:
+                args.append(None)
+                pos += 1
+            elif kind == _BOOL:
+                args.append(buf[pos + 1] == 1)
+                pos += 2
+            elif kind == _INT:
+                args.append(struct.unpack_from('<i', buf, pos + 1)[0])
+                pos += 5
+            elif kind == _FLOAT:
+                args.append(struct.unpack_from('<f', buf, pos + 1)[0])
+                pos += 5
+            else:
+                n = buf[pos + 1]
+                data = bytes(buf[pos + 2:pos + 2 + n])
+                if kind == _BYTES:
+                    args.append(data)
+                else:
+                    text = _decode(data)
+                    args.append(text if kind == _STR else '<%s>' % text)
+                pos += 2 + n
+        return tuple(args)
+
+    def records(self):
+        """
+        Yields (level, ticks_ms, template, args) of all records, oldest first.
+        """
+        i = (self.idx - self.count) % self.size
+        for _ in range(self.count):
+            base = i * self.slot
+            level, ticks, tid, nargs = struct.unpack_from(self.HEADER, self.buf, base)
+            args = self._args(base + self.HEADER_SIZE, nargs)
+            if tid == self.NO_TEMPLATE:
+                template, args = args[0], args[1:]
+            else:
+                template = self.templates[tid]
+            yield level, ticks, template, args
+            i = (i + 1) % self.size
+
+    def clear(self):
+        self.idx = 0
+        self.count = 0
 
 class RotatingLogger:
     DEBUG   = 10
@@ -16,13 +186,16 @@ class RotatingLogger:
         CRITICAL: "CRITICAL"
     }
 
-    def __init__(self, name="Logger", console_level=DEBUG, file_level=WARNING, filename="log.txt", max_size=50*1024):
+    def __init__(self, name="Logger", console_level=DEBUG, file_level=WARNING, filename="log.txt", max_size=50*1024, ring_size=0, ring_level=DEBUG):
         self.name = name
         self.console_level = console_level
         self.file_level = file_level
         self.filename = filename
         self.max_size = max_size
         self.logfile = None
+        # in-RAM ring of recent records, see dump()
+        self.ring_level = ring_level
+        self.ring = LogRing(ring_size) if ring_size else None
         if self.filename:
             self._open_logfile()
 
@@ -63,6 +236,11 @@ class RotatingLogger:
             return "0000-00-00 00:00:00"
 
     def _log(self, level, msg, *args):
+        if self.ring is not None and level >= self.ring_level:
+            self.ring.add(level, msg, args)
+        # skip the formatting if the message goes neither to the shell nor to the file
+        if level < self.console_level and (level < self.file_level or not self.logfile):
+            return
         levelname = self.LEVEL_NAMES.get(level, str(level))
         message = msg % args if args else msg
         log_line = "%s [%s] %s: %s" % (self._timestamp(), levelname, self.name, message)
@@ -87,6 +265,20 @@ class RotatingLogger:
     def error(self, msg, *args):    self._log(self.ERROR, msg, *args)
     def critical(self, msg, *args): self._log(self.CRITICAL, msg, *args)
 
+    def dump(self):
+        """
+        Yields the records of the ring as formatted lines, oldest first.
+        The time is the ticks_ms of the record.
+        """
+        if self.ring is None:
+            return
+        for level, ticks, msg, args in self.ring.records():
+            try:
+                message = msg % args if args else msg
+            except Exception:
+                message = "%s %s" % (msg, args)
+            yield "%d [%s] %s: %s" % (ticks, self.LEVEL_NAMES.get(level, str(level)), self.name, message)
+
     def close(self):
         if self.logfile:
             self.logfile.close()